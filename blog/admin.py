@@ -1,9 +1,12 @@
 from django.contrib import admin
-from django.db.models import Count
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.urls import path
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 
-from .models import Post, Tag, Profile
+from .models import Post, Tag, Profile, QueuedEmail
+from .transfer import export_posts
 
 
 admin.site.unregister(User)
@@ -13,23 +16,43 @@ admin.site.unregister(User)
 class PostAdmin(admin.ModelAdmin):
     list_display = ('title', 'shorted_body', 'display_tags', 'date_pub')
     list_filter = ('date_pub', 'tags')
+    actions = ['export_selected']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('body').prefetch_related('tags')
+
+    def get_urls(self):
+        return [
+            path('export/', self.admin_site.admin_view(self.export_view), name='blog_post_export'),
+        ] + super().get_urls()
+
+    def export_response(self, queryset):
+        response = StreamingHttpResponse(export_posts(queryset), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="posts.jsonl"'
+        return response
+
+    def export_view(self, request):
+        """Every post as JSON lines, streamed."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        return self.export_response(Post.objects.all())
+
+    def export_selected(self, request, queryset):
+        return self.export_response(queryset.order_by())
+
+    export_selected.short_description = 'Export selected posts as JSON lines'
 
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
-    list_display = ('title', 'number_of_posts')
-
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        queryset = queryset.annotate(
-            _number_of_posts=Count("posts")
-            )
-        return queryset
+    list_display = ('title', 'post_count', 'posts_7d', 'posts_30d')
 
-    def number_of_posts(self, obj):
-        return obj._number_of_posts
 
-    number_of_posts.admin_order_field = '_number_of_posts'
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'send_after', 'sent_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'sent_at', 'attempts', 'last_error')
 
 
 class ProfileInline(admin.StackedInline):
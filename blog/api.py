@@ -0,0 +1,275 @@
+"""
+Read-only JSON API.
+
+``/blog/api/posts/``, ``/blog/api/tags/`` and ``/blog/api/profiles/`` list
+objects a cursor page at a time (``?cursor=``, ``?limit=``), the detail
+endpoints return one object.  ``?fields=title,tags`` picks the fields of
+every object and only the columns behind them are read; tags embedded in
+posts come from one query per page.
+
+Pages over ``BLOG_API_STREAM_THRESHOLD`` objects are streamed.  Post and
+tag endpoints share the ETags of their HTML pages' validators, profiles
+hash the body.  ``orjson`` is used for encoding when it is installed.
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+
+from .avatars import avatar_urls
+from .conditional import (conditional, post_detail_validator, posts_list_validator,
+                          tag_detail_validator, tags_list_validator)
+from .models import Post, Profile, Tag, normalize_slug
+from .pagecache import POST_LIST, TAG_LIST, cache_anonymous_page, depend_on, instance_dependency
+from .pagination import CursorPaginator, page_url
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+CONTENT_TYPE = 'application/json'
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class ApiError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def error_response(error):
+    return HttpResponse(dumps({'error': str(error)}), status=error.status, content_type=CONTENT_TYPE)
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+class Resource:
+    """
+    Fields an endpoint can return: name -> ``(columns, getter)``, where
+    ``columns`` are the model fields the value is computed from.
+    """
+    model = None
+    fields = {}
+    default_fields = ()
+    detail_fields = ()
+
+    def selected_fields(self, request, default):
+        requested = request.GET.get('fields')
+        if not requested:
+            return list(default)
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ApiError('Unknown field(s): {}. Available: {}'.format(
+                ', '.join(unknown), ', '.join(self.fields)))
+        return list(dict.fromkeys(names))
+
+    def narrow(self, queryset, names, extra_columns=()):
+        columns = set(extra_columns)
+        for name in names:
+            columns.update(self.fields[name][0])
+        return queryset.only(*columns)
+
+    def related(self, objects, names):
+        """Data loaded for a whole page at once, passed to the getters."""
+        return {}
+
+    def serialize(self, objects, names, related=None):
+        if related is None:
+            related = self.related(objects, names)
+        return [{name: self.fields[name][1](obj, related) for name in names} for obj in objects]
+
+
+def _tags_by_post(posts, names):
+    if 'tags' not in names:
+        return {}
+    tags = defaultdict(list)
+    links = (Post.tags.through.objects.filter(post_id__in=[post.pk for post in posts])
+             .order_by('tag__title').values_list('post_id', 'tag__title', 'tag__slug'))
+    for post_id, title, slug in links:
+        tags[post_id].append({'title': title, 'slug': slug})
+    return {'tags': tags}
+
+
+class PostResource(Resource):
+    model = Post
+    fields = {
+        'id': (('pk',), lambda post, related: post.pk),
+        'title': (('title',), lambda post, related: post.title),
+        'slug': (('slug',), lambda post, related: post.slug),
+        'url': (('slug',), lambda post, related: post.get_absolute_url()),
+        'excerpt': (('excerpt',), lambda post, related: post.excerpt),
+        'body': (('body',), lambda post, related: post.body),
+        'date_pub': (('date_pub',), lambda post, related: _isoformat(post.date_pub)),
+        'updated_at': (('updated_at',), lambda post, related: _isoformat(post.updated_at)),
+        'tags': ((), lambda post, related: related['tags'][post.pk]),
+    }
+    default_fields = ('id', 'title', 'slug', 'url', 'excerpt', 'date_pub', 'tags')
+    detail_fields = default_fields + ('body', 'updated_at')
+
+    def related(self, objects, names):
+        return _tags_by_post(objects, names)
+
+
+class TagResource(Resource):
+    model = Tag
+    fields = {
+        'id': (('pk',), lambda tag, related: tag.pk),
+        'title': (('title',), lambda tag, related: tag.title),
+        'slug': (('slug',), lambda tag, related: tag.slug),
+        'url': (('slug',), lambda tag, related: tag.get_absolute_url()),
+        'post_count': (('post_count',), lambda tag, related: tag.post_count),
+        'posts_7d': (('posts_7d',), lambda tag, related: tag.posts_7d),
+        'posts_30d': (('posts_30d',), lambda tag, related: tag.posts_30d),
+        'updated_at': (('updated_at',), lambda tag, related: _isoformat(tag.updated_at)),
+    }
+    default_fields = ('id', 'title', 'slug', 'url', 'post_count')
+    detail_fields = default_fields + ('posts_7d', 'posts_30d', 'updated_at')
+
+
+class ProfileResource(Resource):
+    model = Profile
+    fields = {
+        'id': (('user',), lambda profile, related: profile.user_id),
+        'username': (('user', 'user__username'), lambda profile, related: profile.user.username),
+        'url': (('user',), lambda profile, related: profile.get_absolute_url()),
+        'bio': (('bio',), lambda profile, related: profile.bio),
+        'location': (('location',), lambda profile, related: profile.location),
+        'avatar': (('avatar', 'avatar_hash'),
+                   lambda profile, related: avatar_urls(profile, 160)['src']),
+    }
+    default_fields = ('id', 'username', 'url', 'avatar')
+    detail_fields = default_fields + ('bio', 'location')
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', settings.BLOG_API_PAGE_SIZE))
+    except ValueError:
+        raise ApiError('limit must be a number')
+    return max(1, min(limit, settings.BLOG_API_MAX_PAGE_SIZE))
+
+
+def _list_response(request, resource, queryset, ordering):
+    names = resource.selected_fields(request, resource.default_fields)
+    queryset = resource.narrow(queryset, names, [name.lstrip('-') for name in ordering])
+    page = CursorPaginator(queryset, _limit(request), ordering).page(request.GET.get('cursor'))
+    links = {
+        'next': page.next_cursor and request.path + page_url(request, 'cursor', page.next_cursor),
+        'previous': page.previous_cursor and request.path + page_url(request, 'cursor', page.previous_cursor),
+    }
+    if len(page.object_list) <= settings.BLOG_API_STREAM_THRESHOLD:
+        data = dict(links, results=resource.serialize(page.object_list, names))
+        return HttpResponse(dumps(data), content_type=CONTENT_TYPE)
+    return StreamingHttpResponse(_stream(resource, page.object_list, names, links),
+                                 content_type=CONTENT_TYPE)
+
+
+def _stream(resource, objects, names, links):
+    head = dumps(links)
+    yield head[:-1] + b',"results":['
+    # One query for the whole page, not one per chunk.
+    related = resource.related(objects, names)
+    chunk_size = settings.BLOG_API_STREAM_CHUNK
+    for start in range(0, len(objects), chunk_size):
+        items = resource.serialize(objects[start:start + chunk_size], names, related)
+        body = b','.join(dumps(item) for item in items)
+        yield body if start == 0 else b',' + body
+    yield b']}'
+
+
+def _detail_response(request, resource, queryset):
+    names = resource.selected_fields(request, resource.detail_fields)
+    obj = resource.narrow(queryset, names).first()
+    if obj is None:
+        raise ApiError('Not found', status=404)
+    depend_on(request, instance_dependency(obj))
+    return HttpResponse(dumps(resource.serialize([obj], names)[0]), content_type=CONTENT_TYPE)
+
+
+def api_view(view):
+    """Turn ``ApiError`` into a JSON error response."""
+    def wrapped(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return error_response(error)
+    wrapped.__name__ = view.__name__
+    wrapped.__doc__ = view.__doc__
+    return wrapped
+
+
+@require_safe
+@conditional(posts_list_validator)
+@cache_anonymous_page
+@api_view
+def posts(request):
+    depend_on(request, POST_LIST)
+    queryset = Post.objects.all()
+    tag = request.GET.get('tag')
+    if tag:
+        queryset = queryset.filter(tags__slug=normalize_slug(tag))
+    return _list_response(request, PostResource(), queryset, ('-date_pub', '-pk'))
+
+
+@require_safe
+@conditional(post_detail_validator)
+@cache_anonymous_page
+@api_view
+def post_detail(request, slug):
+    return _detail_response(request, PostResource(), Post.objects.filter(slug=normalize_slug(slug)))
+
+
+@require_safe
+@conditional(tags_list_validator)
+@cache_anonymous_page
+@api_view
+def tags(request):
+    depend_on(request, TAG_LIST)
+    return _list_response(request, TagResource(), Tag.objects.all(), ('title',))
+
+
+@require_safe
+@conditional(tag_detail_validator)
+@cache_anonymous_page
+@api_view
+def tag_detail(request, slug):
+    return _detail_response(request, TagResource(), Tag.objects.filter(slug=normalize_slug(slug)))
+
+
+def _with_content_etag(request, response):
+    if response.streaming or response.status_code != 200:
+        return response
+    etag = quote_etag(hashlib.md5(response.content).hexdigest())
+    response['ETag'] = etag
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+@require_safe
+@api_view
+def profiles(request):
+    queryset = Profile.objects.filter(email_confirmed=True).select_related('user')
+    response = _list_response(request, ProfileResource(), queryset, ('user__username',))
+    return _with_content_etag(request, response)
+
+
+@require_safe
+@api_view
+def profile_detail(request, pk):
+    queryset = Profile.objects.filter(email_confirmed=True, user_id=pk).select_related('user')
+    return _with_content_etag(request, _detail_response(request, ProfileResource(), queryset))
@@ -0,0 +1,219 @@
+"""
+Search-as-you-type over post and tag titles.
+
+``PrefixIndex`` keeps, per kind, a sorted list of ``(key, pk)`` pairs where
+the keys are the folded title from each of its words on ("django orm tips"
+is found by "dja", "orm t" and "tip"), so a prefix lookup is one
+``bisect`` and a short scan.  It is built from the database on first use
+and afterwards answers without a query.
+
+``blog.signals`` updates the index of the process that saved a post or tag
+and publishes the change as a ``(kind, op, rows)`` entry of a
+``ChangeLog``.  Other processes read the log at most every
+``BLOG_AUTOCOMPLETE_RECHECK`` seconds and replay the changes they have not
+seen, without a query.  When some are gone, and every
+``BLOG_AUTOCOMPLETE_REBUILD`` seconds in case a cache without an atomic
+``add`` lost one, the index is reloaded from the database in a background
+thread while lookups keep using the old one.
+"""
+import threading
+import time
+import uuid
+from bisect import bisect_left, insort
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.urls import reverse
+from django.views.decorators.http import require_safe
+
+from .api import CONTENT_TYPE, ApiError, api_view, dumps
+from .changelog import ChangeLog
+from .models import Post, Tag
+from .search import tokenize
+from .utils import PLACEHOLDER
+
+
+changes = ChangeLog('autocomplete')
+# Longer keys are cut, a query that long is matched on its start.
+KEY_LENGTH = 48
+
+# Tags are suggested first, there are fewer of them.
+KINDS = (
+    ('tag', Tag, 'tag_detail_url'),
+    ('post', Post, 'post_detail_url'),
+)
+KIND_NAMES = [kind for kind, model, url_name in KINDS]
+
+
+def title_keys(title):
+    tokens = tokenize(title)
+    return {' '.join(tokens[start:])[:KEY_LENGTH] for start in range(len(tokens))}
+
+
+def _query_key(query):
+    return ' '.join(tokenize(query))[:KEY_LENGTH]
+
+
+class PrefixIndex:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._rebuilding = False
+        # Number of the last change applied.
+        self._position = 0
+        self._checked = 0.0
+        self._built_at = 0.0
+        self._url_patterns = {}
+        self._keys = {kind: [] for kind, model, url_name in KINDS}
+        # kind -> {pk: (title, url, keys)}
+        self._items = {kind: {} for kind, model, url_name in KINDS}
+
+    def _url(self, kind, slug):
+        return self._url_patterns[kind].replace(PLACEHOLDER, quote(slug))
+
+    def _load(self):
+        url_patterns, keys, items = {}, {}, {}
+        for kind, model, url_name in KINDS:
+            url_patterns[kind] = pattern = reverse(url_name, kwargs={'slug': PLACEHOLDER})
+            loaded = {}
+            for pk, title, slug in model.objects.values_list('pk', 'title', 'slug').iterator():
+                loaded[pk] = (title, pattern.replace(PLACEHOLDER, quote(slug)), title_keys(title))
+            items[kind] = loaded
+            keys[kind] = sorted((key, pk) for pk, item in loaded.items() for key in item[2])
+        return url_patterns, keys, items
+
+    def rebuild(self):
+        # Changes published while loading are replayed on top.
+        position = changes.sequence()
+        url_patterns, keys, items = self._load()
+        with self._lock:
+            self._url_patterns, self._keys, self._items = url_patterns, keys, items
+            self._position = position
+            self._built = True
+            self._built_at = self._checked = time.monotonic()
+            self._catch_up()
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._background_rebuild, daemon=True).start()
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    def _catch_up(self):
+        """Replay the changes published since ``_position``, False if some are gone."""
+        published = changes.since(self._position)
+        if published is None:
+            return False
+        self._position, entries = published
+        for kind, op, rows in entries:
+            if op == 'put':
+                self._put(kind, rows)
+            else:
+                self._remove(kind, rows)
+        return True
+
+    def _ensure_current(self):
+        now = time.monotonic()
+        if self._built and now - self._checked < settings.BLOG_AUTOCOMPLETE_RECHECK:
+            return
+        with self._lock:
+            if not self._built:
+                # Nothing to serve meanwhile.
+                self.rebuild()
+                return
+            self._checked = now
+            current = self._catch_up()
+        if not current or now - self._built_at >= settings.BLOG_AUTOCOMPLETE_REBUILD:
+            self._rebuild_in_background()
+
+    def _discard(self, kind, pk):
+        item = self._items[kind].pop(pk, None)
+        if item is not None:
+            keys = self._keys[kind]
+            for key in item[2]:
+                del keys[bisect_left(keys, (key, pk))]
+
+    def _put(self, kind, rows):
+        for pk, title, slug in rows:
+            self._discard(kind, pk)
+            item = (title, self._url(kind, slug), title_keys(title))
+            self._items[kind][pk] = item
+            for key in item[2]:
+                insort(self._keys[kind], (key, pk))
+
+    def _remove(self, kind, pks):
+        for pk in pks:
+            self._discard(kind, pk)
+
+    def put(self, kind, rows):
+        """Add or replace the ``(pk, title, slug)`` rows of ``kind``."""
+        rows = list(rows)
+        with self._lock:
+            if self._built:
+                self._put(kind, rows)
+        changes.publish((kind, 'put', rows))
+
+    def remove(self, kind, pks):
+        pks = list(pks)
+        with self._lock:
+            if self._built:
+                self._remove(kind, pks)
+        changes.publish((kind, 'remove', pks))
+
+    def lookup(self, query, kinds=None, limit=10):
+        """Up to ``limit`` ``{'type', 'title', 'url'}`` suggestions for ``query``."""
+        prefix = _query_key(query)
+        if not prefix:
+            return []
+        self._ensure_current()
+        results = []
+        with self._lock:
+            for kind, model, url_name in KINDS:
+                if kinds is not None and kind not in kinds:
+                    continue
+                keys, items, seen = self._keys[kind], self._items[kind], set()
+                position = bisect_left(keys, (prefix,))
+                while position < len(keys) and len(results) < limit:
+                    key, pk = keys[position]
+                    if not key.startswith(prefix):
+                        break
+                    if pk not in seen:
+                        seen.add(pk)
+                        title, url, item_keys = items[pk]
+                        results.append({'type': kind, 'title': title, 'url': url})
+                    position += 1
+        return results
+
+
+index = PrefixIndex()
+
+
+def put_posts(posts):
+    index.put('post', [(post.pk, post.title, post.slug) for post in posts])
+
+
+def put_tags(tags):
+    index.put('tag', [(tag.pk, tag.title, tag.slug) for tag in tags])
+
+
+@require_safe
+@api_view
+def suggest(request):
+    """``?q=<prefix>[&type=post|tag]``, answered from the in-process index."""
+    kind = request.GET.get('type')
+    if kind is not None and kind not in KIND_NAMES:
+        raise ApiError('Unknown type: {}. Available: {}'.format(kind, ', '.join(KIND_NAMES)))
+    kinds = {kind} if kind else None
+    results = index.lookup(request.GET.get('q', ''), kinds, settings.BLOG_AUTOCOMPLETE_LIMIT)
+    return HttpResponse(dumps({'results': results}), content_type=CONTENT_TYPE)
@@ -0,0 +1,158 @@
+"""
+Off-request avatar processing.
+
+Uploads are stored as they come and leave ``Profile.avatar_hash`` empty.
+The ``process_avatars`` command then picks pending profiles, hashes the
+source in chunks and, unless that content was processed before, writes
+square thumbnails in every ``BLOG_AVATAR_SIZES`` size as WebP plus a JPEG
+fallback, and a re-encoded ``full.jpg`` that replaces the upload.
+Re-encoding drops EXIF, GPS and other metadata, and the upload itself is
+deleted, so nothing served from ``avatars/<hash>/`` carries it.
+Identical images, like the shared default, are stored once.
+
+Decoding is bounded: images over ``BLOG_AVATAR_MAX_PIXELS`` are rejected
+before their pixels are read.  ``full.jpg`` keeps the full resolution, the
+thumbnails are cut from a copy first reduced by an integer factor.
+"""
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from .models import Profile
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+WEBP = features.check('webp')
+
+
+class AvatarError(Exception):
+    pass
+
+
+def _directory(digest):
+    return 'avatars/{}/{}'.format(digest[:2], digest)
+
+
+def variant_name(digest, size, extension):
+    return '{}/{}.{}'.format(_directory(digest), size, extension)
+
+
+def _pick_size(size):
+    sizes = sorted(settings.BLOG_AVATAR_SIZES)
+    for candidate in sizes:
+        if candidate >= size:
+            return candidate
+    return sizes[-1]
+
+
+def avatar_urls(profile, size):
+    """``{'src', 'webp', 'size'}`` for the variant closest to ``size``."""
+    if not profile.avatar_processed:
+        return {'src': profile.avatar.url, 'webp': None, 'size': size}
+    size = _pick_size(size)
+    webp = None
+    if WEBP:
+        webp = default_storage.url(variant_name(profile.avatar_hash, size, 'webp'))
+    return {
+        'src': default_storage.url(variant_name(profile.avatar_hash, size, 'jpg')),
+        'webp': webp,
+        'size': size,
+    }
+
+
+def _source_name(profile):
+    # The default avatar is stored with a leading slash.
+    return profile.avatar.name.lstrip('/')
+
+
+def _hash(name):
+    digest = hashlib.sha256()
+    with default_storage.open(name, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode(image, extension):
+    output = io.BytesIO()
+    if extension == 'webp':
+        image.save(output, 'WEBP', quality=80, method=4)
+    else:
+        if image.mode != 'RGB':
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+            image = background
+        image.save(output, 'JPEG', quality=85, optimize=True, progressive=True)
+    return ContentFile(output.getvalue())
+
+
+def full_name(digest):
+    return variant_name(digest, 'full', 'jpg')
+
+
+def _write_variants(name, digest):
+    largest = max(settings.BLOG_AVATAR_SIZES)
+    with default_storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        width, height = image.size
+        if width * height > settings.BLOG_AVATAR_MAX_PIXELS:
+            raise AvatarError('{}x{} image is too large'.format(width, height))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    if not default_storage.exists(full_name(digest)):
+        default_storage.save(full_name(digest), _encode(image, 'jpg'))
+    # A cheap box reduction first, keeping twice the largest size for LANCZOS.
+    factor = min(image.size) // (largest * 2)
+    if factor > 1:
+        image = image.reduce(factor)
+    extensions = ['jpg', 'webp'] if WEBP else ['jpg']
+    for size in settings.BLOG_AVATAR_SIZES:
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for extension in extensions:
+            target = variant_name(digest, size, extension)
+            if not default_storage.exists(target):
+                default_storage.save(target, _encode(thumbnail, extension))
+
+
+def process(profile):
+    name = _source_name(profile)
+    digest = _hash(name)
+    full = full_name(digest)
+    if not default_storage.exists(full):
+        _write_variants(name, digest)
+
+    # Only the re-encoded copy is kept, the upload and its metadata go,
+    # unless another profile still points at it (see migration 0027).
+    if (name != full and name != Profile.avatar.field.default.lstrip('/')
+            and not Profile.objects.filter(avatar=name).exclude(pk=profile.pk).exists()):
+        default_storage.delete(name)
+
+    # A newer upload that arrived meanwhile stays pending.
+    (Profile.objects.filter(pk=profile.pk, avatar=profile.avatar.name)
+     .update(avatar=full, avatar_hash=digest))
+
+
+def process_pending(batch_size=20):
+    """Process one batch of pending avatars, return ``(done, failed)`` counts."""
+    pending = Profile.objects.filter(avatar_hash='').order_by('pk')[:batch_size]
+    done = failed = 0
+    for profile in pending:
+        try:
+            process(profile)
+        except (OSError, AvatarError, Image.DecompressionBombError) as error:
+            logger.warning('Avatar of profile %s not processed: %s', profile.pk, error)
+            # Park the profile on its source so it is not retried forever.
+            Profile.objects.filter(pk=profile.pk).update(avatar_hash=Profile.AVATAR_FAILED)
+            failed += 1
+        else:
+            done += 1
+    return done, failed
@@ -0,0 +1,54 @@
+"""
+Changes published through the cache for the in-process indexes of other
+processes.
+
+A ``ChangeLog`` stores numbered entries, each slot claimed with
+``cache.add`` so concurrent publishers take different numbers, and the
+last number under its sequence key.  A reader remembers the number it
+has applied and asks ``since`` for what followed; ``None`` means entries
+are gone (expired, evicted, the cache was cleared, or too many to be
+worth replaying) and the reader has to reload from the database.
+"""
+from django.core.cache import cache
+
+
+class ChangeLog:
+
+    def __init__(self, name, timeout=60 * 60 * 24, max_replay=500):
+        self.name = name
+        self.timeout = timeout
+        # Further behind than this, reloading is cheaper than replaying.
+        self.max_replay = max_replay
+
+    def _sequence_key(self):
+        return 'blog:{}-seq'.format(self.name)
+
+    def _entry_key(self, number):
+        return 'blog:{}-delta:{}'.format(self.name, number)
+
+    def sequence(self):
+        """Number of the last published change, where a reload starts."""
+        return cache.get(self._sequence_key(), 0)
+
+    def publish(self, change):
+        number = self.sequence()
+        while True:
+            number += 1
+            # Taken by a concurrent publish, try the next slot.
+            if cache.add(self._entry_key(number), change, self.timeout):
+                break
+        cache.set(self._sequence_key(), number, None)
+
+    def since(self, position):
+        """``(sequence, changes)`` published after ``position``, or ``None``."""
+        sequence = self.sequence()
+        if sequence - position > self.max_replay:
+            return None
+        # The last applied entry is read again: when it is gone the log
+        # was cleared or expired and the numbers can't be trusted.
+        first = max(position, 1)
+        keys = [self._entry_key(number) for number in range(first, max(sequence, position) + 1)]
+        found = cache.get_many(keys)
+        if len(found) < len(keys):
+            return None
+        return max(sequence, position), [found[key] for key in keys[1 if position else 0:]]
@@ -0,0 +1,140 @@
+"""
+ETag / Last-Modified validators for the read views.
+
+Each validator returns ``(last_modified, parts)``.  The parts are the
+page-cache generations of what the page shows, which ``blog.signals`` bumps
+on every change, so the ETag moves exactly when the cached page is
+invalidated.  ``last_modified`` is the newest ``updated_at`` of the rows
+shown, read with one indexed aggregate and cached under the generation, so
+it is only read again after a change; a matching request gets a 304
+without a query.  Detail pages find their row's id through a cached slug
+map, see ``slug_id``.
+
+Deleting a row does not move ``Last-Modified``; Django checks
+``If-None-Match`` first, so clients sending both still see the change.
+
+The ETag hashes the parts together with the query string and the viewing
+user, whose name and admin links are part of the page.  ``conditional``
+wires a validator into Django's ``condition`` decorator so matching
+requests get a 304 before the view runs.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.views.decorators.http import condition
+
+from .models import Post, Tag, normalize_slug
+from .pagecache import POST_LIST, TAG_LIST, generations, post_dependency, tag_dependency
+
+
+def _slug_key(model, slug):
+    return 'blog:slug-id:{}:{}'.format(model._meta.model_name, slug)
+
+
+def slug_id(model, slug):
+    """
+    Id of the ``model`` row with ``slug``, 0 if there is none.  Only found
+    ids are cached: any url can be requested, caching misses would let
+    made-up slugs crowd out the cache.
+    """
+    key = _slug_key(model, slug)
+    pk = cache.get(key)
+    if pk is None:
+        pk = model.objects.filter(slug=slug).values_list('pk', flat=True).first()
+        if pk is None:
+            return 0
+        cache.set(key, pk, None)
+    return pk
+
+
+def forget_slugs(model, slugs):
+    """Drop cached ids of ``slugs`` that were taken or given up."""
+    cache.delete_many([_slug_key(model, slug) for slug in slugs if slug])
+
+
+def _generation(dependency):
+    return generations([dependency])[dependency]
+
+
+def _newest(values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _validated(dependency, newest_update):
+    """
+    ``(last_modified, generation)`` of ``dependency``; ``newest_update`` is
+    only called when this generation has no cached last modification yet.
+    """
+    generation = _generation(dependency)
+    key = 'blog:last-modified:{}:{}'.format(dependency, generation)
+    last_modified = cache.get(key)
+    if last_modified is None:
+        last_modified = newest_update()
+        if last_modified is not None:
+            cache.set(key, last_modified, settings.BLOG_PAGE_CACHE_TIMEOUT)
+    return last_modified, generation
+
+
+def posts_list_validator(request):
+    return _validated(POST_LIST, lambda: Post.objects.aggregate(last=Max('updated_at'))['last'])
+
+
+def post_detail_validator(request, slug):
+    pk = slug_id(Post, normalize_slug(slug))
+    if not pk:
+        return None
+
+    def newest_update():
+        # The related posts' titles are part of the page.
+        row = (Post.objects.filter(pk=pk).order_by()
+               .annotate(last_related=Max('related_posts__related__updated_at'))
+               .values_list('updated_at', 'last_related').first())
+        return _newest(row or ())
+
+    last_modified, generation = _validated(post_dependency(pk), newest_update)
+    return last_modified, (pk, generation)
+
+
+def tag_detail_validator(request, slug):
+    pk = slug_id(Tag, normalize_slug(slug))
+    if not pk:
+        return None
+
+    def newest_update():
+        # Tag.updated_at moves when posts join or leave, post rows when
+        # they are edited.
+        row = (Tag.objects.filter(pk=pk).order_by()
+               .annotate(last_post=Max('posts__updated_at'))
+               .values_list('updated_at', 'last_post').first())
+        return _newest(row or ())
+
+    last_modified, generation = _validated(tag_dependency(pk), newest_update)
+    return last_modified, (pk, generation)
+
+
+def tags_list_validator(request):
+    return _validated(TAG_LIST, lambda: Tag.objects.aggregate(last=Max('updated_at'))['last'])
+
+
+def conditional(validator):
+    def state(request, *args, **kwargs):
+        if not hasattr(request, '_conditional_state'):
+            request._conditional_state = validator(request, *args, **kwargs)
+        return request._conditional_state
+
+    def etag(request, *args, **kwargs):
+        current = state(request, *args, **kwargs)
+        if current is None:
+            return None
+        user = request.user
+        key = repr((current[1], request.get_full_path(), user.pk, user.is_staff))
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        current = state(request, *args, **kwargs)
+        return current[0] if current else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,89 @@
+"""
+RSS and Atom feeds of the latest posts, globally and per tag.
+
+Feeds are built from the stored excerpts and kept in the anonymous page
+cache until the posts or tag they show change.  Their ETags are derived
+from the page-cache generations alone, so a poll that matches is answered
+with a 304 without touching the database, see ``blog.conditional``.
+"""
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.shortcuts import get_object_or_404, reverse
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+
+from .conditional import conditional, posts_list_validator, tag_detail_validator
+from .models import Post, Tag, normalize_slug
+from .pagecache import POST_LIST, cache_anonymous_page, depend_on, tag_dependency
+
+
+class LatestPostsFeed(Feed):
+    feed_type = Rss201rev2Feed
+    title = 'Blog: latest posts'
+    description = 'The latest posts of the blog.'
+
+    def get_object(self, request, *args, **kwargs):
+        depend_on(request, POST_LIST)
+        return None
+
+    def link(self):
+        return reverse('posts_list_url')
+
+    def posts(self, obj):
+        return Post.objects.all()
+
+    def items(self, obj):
+        posts = self.posts(obj).defer('body').prefetch_related('tags')
+        return posts.order_by('-date_pub', '-pk')[:settings.BLOG_FEED_ITEMS]
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        return item.excerpt
+
+    def item_pubdate(self, item):
+        return item.date_pub
+
+    def item_updateddate(self, item):
+        return item.updated_at
+
+    def item_categories(self, item):
+        return [tag.title for tag in item.tags.all()]
+
+
+class LatestPostsAtomFeed(LatestPostsFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostsFeed.description
+
+
+class TagPostsFeed(LatestPostsFeed):
+
+    def get_object(self, request, slug):
+        tag = get_object_or_404(Tag, slug=normalize_slug(slug))
+        depend_on(request, tag_dependency(tag.pk))
+        return tag
+
+    def title(self, obj):
+        return 'Blog: posts tagged "{}"'.format(obj.title)
+
+    def description(self, obj):
+        return 'The latest posts tagged "{}".'.format(obj.title)
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def posts(self, obj):
+        return obj.posts.all()
+
+
+class TagPostsAtomFeed(TagPostsFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self.description(obj)
+
+
+latest_rss = conditional(posts_list_validator)(cache_anonymous_page(LatestPostsFeed()))
+latest_atom = conditional(posts_list_validator)(cache_anonymous_page(LatestPostsAtomFeed()))
+tag_rss = conditional(tag_detail_validator)(cache_anonymous_page(TagPostsFeed()))
+tag_atom = conditional(tag_detail_validator)(cache_anonymous_page(TagPostsAtomFeed()))
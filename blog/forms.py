@@ -1,10 +1,13 @@
 import datetime
 from django import forms
 from django.core.exceptions import ValidationError
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import UserCreationForm, PasswordResetForm
 from django.contrib.auth.models import User
 
-from .models import Tag, Post, Profile
+from django.template import loader
+
+from .models import Tag, Post, Profile, normalize_slug
+from .outbox import enqueue
 
 
 class TagForm(forms.ModelForm):
@@ -19,7 +22,7 @@ class TagForm(forms.ModelForm):
         }
 
     def clean_slug(self):
-        new_slug = self.cleaned_data['slug'].lower()
+        new_slug = normalize_slug(self.cleaned_data['slug'])
 
         if new_slug == 'create':
             raise ValidationError('Slug may not be "Create"')
@@ -40,7 +43,7 @@ class PostForm(forms.ModelForm):
         }
 
     def clean_slug(self):
-        new_slug = self.cleaned_data['slug'].lower()
+        new_slug = normalize_slug(self.cleaned_data['slug'])
 
         if new_slug == 'create':
             raise ValidationError('slug may not be "Create"')
@@ -66,6 +69,20 @@ class SignUpForm(UserCreationForm):
         }
 
 
+class OutboxPasswordResetForm(PasswordResetForm):
+    """Queues the reset mail in the outbox instead of sending it inline."""
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email, html_email_template_name=None):
+        subject = loader.render_to_string(subject_template_name, context)
+        subject = ''.join(subject.splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = ''
+        if html_email_template_name is not None:
+            html_body = loader.render_to_string(html_email_template_name, context)
+        enqueue(subject, body, [to_email], from_email, html_body)
+
+
 class UserForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super(UserForm, self).__init__(*args, **kwargs)
@@ -106,6 +123,12 @@ class ProfileForm(forms.ModelForm):
                 'avatar' : 'Change avatar'
         }     
 
+    def save(self, commit=True):
+        if 'avatar' in self.changed_data:
+            # Queue the new upload for blog.avatars.
+            self.instance.avatar_hash = ''
+        return super().save(commit)
+
     def clean_birth_date(self):
         birth_date = self.cleaned_data['birth_date']
         if birth_date and birth_date > datetime.date.today():
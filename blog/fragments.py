@@ -0,0 +1,117 @@
+"""
+Cache of rendered post cards.
+
+Every card is cached under its post id and a version token.  Bumping a
+post's version (on save, tag changes and tag renames) makes the next render
+miss and store a fresh card; the stale one simply expires.  A missing
+version is replaced by a new random token, so an evicted version can never
+resurrect an old card.
+
+Hits and misses are counted in process memory and added to the shared
+counters in the cache at most every ``BLOG_CARD_STATS_FLUSH`` seconds, so
+a render never writes them; ``stats`` includes the unflushed counts of the
+calling process only.
+"""
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+
+CARD_TEMPLATE = 'blog/includes/post_card_template.html'
+
+STATS_KEYS = {
+    'hits': 'blog:card-stats:hits',
+    'misses': 'blog:card-stats:misses',
+}
+
+
+def _version_key(pk):
+    return 'blog:card-version:{}'.format(pk)
+
+
+def _card_key(pk, version):
+    return 'blog:card:{}:{}'.format(pk, version)
+
+
+def bump_versions(post_ids):
+    cache.delete_many([_version_key(pk) for pk in post_ids])
+
+
+def _card_keys(posts):
+    version_keys = {post.pk: _version_key(post.pk) for post in posts}
+    versions = cache.get_many(list(version_keys.values()))
+    new_versions = {}
+    for key in version_keys.values():
+        if key not in versions:
+            versions[key] = new_versions[key] = uuid.uuid4().hex
+    if new_versions:
+        cache.set_many(new_versions, None)
+    return {pk: _card_key(pk, versions[key]) for pk, key in version_keys.items()}
+
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+_flushed = time.monotonic()
+
+
+def flush_stats():
+    """Add this process's counts to the shared counters."""
+    global _flushed
+    with _counts_lock:
+        counts = dict(_counts)
+        _counts.clear()
+        _flushed = time.monotonic()
+    for name, amount in counts.items():
+        if amount:
+            key = STATS_KEYS[name]
+            cache.add(key, 0, None)
+            try:
+                cache.incr(key, amount)
+            except ValueError:
+                # Evicted between add() and incr().
+                cache.set(key, amount, None)
+
+
+def _count(hits, misses):
+    with _counts_lock:
+        _counts['hits'] += hits
+        _counts['misses'] += misses
+        due = time.monotonic() - _flushed >= settings.BLOG_CARD_STATS_FLUSH
+    if due:
+        flush_stats()
+
+
+def render_cards(posts):
+    """HTML for the cards of ``posts``, reusing cached cards where possible."""
+    posts = list(posts)
+    keys = _card_keys(posts)
+    cached = cache.get_many(list(keys.values()))
+    cards = []
+    rendered = {}
+    for post in posts:
+        key = keys[post.pk]
+        card = cached.get(key)
+        if card is None:
+            card = rendered[key] = render_to_string(CARD_TEMPLATE, {'post': post})
+        cards.append(card)
+    if rendered:
+        cache.set_many(rendered, settings.BLOG_CARD_CACHE_TIMEOUT)
+    _count(len(posts) - len(rendered), len(rendered))
+    return ''.join(cards)
+
+
+def stats():
+    flush_stats()
+    values = cache.get_many(list(STATS_KEYS.values()))
+    return {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+
+
+def reset_stats():
+    with _counts_lock:
+        _counts.clear()
+    cache.delete_many(list(STATS_KEYS.values()))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from blog import fragments, pagecache, signals
+from blog.models import Post, make_excerpt
+
+
+class Command(BaseCommand):
+    help = 'Fill Post.excerpt for posts saved without one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every excerpt, not only empty ones')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.only('pk', 'body', 'excerpt').order_by('pk')
+        if not options['all']:
+            posts = posts.filter(excerpt='')
+
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(posts.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            changed = []
+            for post in batch:
+                excerpt = make_excerpt(post.body)
+                if excerpt != post.excerpt:
+                    post.excerpt = excerpt
+                    changed.append(post)
+            if not changed:
+                continue
+            post_ids = [post.pk for post in changed]
+            Post.objects.bulk_update(changed, ['excerpt'])
+            # Written around the signals, invalidate like they would.
+            signals.touch(post_ids)
+            fragments.bump_versions(post_ids)
+            signals.bump_pages(post_ids, signals.post_tag_ids(post_ids), [pagecache.POST_LIST])
+            updated += len(changed)
+        self.stdout.write('Updated {} excerpt(s)'.format(updated))
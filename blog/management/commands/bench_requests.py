@@ -0,0 +1,233 @@
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from blog.models import Post, Profile, Tag
+from blog.pagination import CursorPaginator
+from blog.perf import PERCENTILES, percentile, server_timing_queries
+
+
+# Request kinds and their default share of the mix.
+MIX = (
+    ('index', 25),
+    ('deep', 10),
+    ('search', 15),
+    ('tag', 15),
+    ('post', 25),
+    ('profile', 10),
+)
+
+
+def parse_mix(value):
+    mix = dict(MIX)
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in mix or not weight.isdigit():
+            raise CommandError('Bad --mix entry "{}", expected kind=weight with kind one of {}'
+                               .format(part, ', '.join(mix)))
+        mix[kind] = int(weight)
+    return mix
+
+
+class Targets:
+    """Random URLs of every request kind, drawn from a sample of the data."""
+
+    def __init__(self, rng, sample_size):
+        self.rng = rng
+        post_ids = list(Post.objects.values_list('pk', flat=True))
+        sample = rng.sample(post_ids, min(sample_size, len(post_ids)))
+        self.posts = list(Post.objects.filter(pk__in=sample).only('pk', 'slug', 'title', 'date_pub'))
+        self.tags = list(Tag.objects.only('pk', 'slug'))
+        self.profile_user_ids = list(Profile.objects.filter(email_confirmed=True)
+                                     .values_list('user_id', flat=True)[:sample_size])
+        self.paginator = CursorPaginator(Post.objects.all(), settings.BLOG_POSTS_PER_PAGE)
+        self.index_url = reverse('posts_list_url')
+        if not self.posts:
+            raise CommandError('There are no posts, run seed_blog first')
+
+    def available(self, kind):
+        return {'tag': self.tags, 'profile': self.profile_user_ids}.get(kind, True)
+
+    def url(self, kind):
+        if kind == 'index':
+            return self.index_url
+        if kind == 'deep':
+            cursor = self.paginator.encode_cursor(self.rng.choice(self.posts))
+            return self.index_url + '?' + urlencode({'cursor': cursor})
+        if kind == 'search':
+            word = self.rng.choice(self.rng.choice(self.posts).title.split())
+            return self.index_url + '?' + urlencode({'search': word})
+        if kind == 'tag':
+            return self.rng.choice(self.tags).get_absolute_url()
+        if kind == 'post':
+            return self.rng.choice(self.posts).get_absolute_url()
+        return reverse('user_profile_url', kwargs={'pk': self.rng.choice(self.profile_user_ids)})
+
+
+class TestClientRunner:
+    concurrency = 1
+
+    def __init__(self):
+        # Query counts are read from the Server-Timing header.
+        override_settings(BLOG_SERVER_TIMING=True).enable()
+        hosts = [host for host in settings.ALLOWED_HOSTS if host and '*' not in host]
+        self.client = Client(HTTP_HOST=hosts[0].lstrip('.') if hosts else 'localhost')
+
+    def fetch(self, url):
+        started = time.perf_counter()
+        response = self.client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        latency = (time.perf_counter() - started) * 1000
+        return response.status_code, latency, server_timing_queries(response.get('Server-Timing'))
+
+
+class HttpRunner:
+
+    def __init__(self, base_url, concurrency):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+
+    def fetch(self, url):
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(self.base_url + url) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as error:
+            error.read()
+            status, headers = error.code, error.headers
+        latency = (time.perf_counter() - started) * 1000
+        return status, latency, server_timing_queries(headers.get('Server-Timing'))
+
+
+def summarize(results):
+    latencies = sorted(latency for status, latency, queries in results)
+    queries = [queries for status, latency, queries in results if queries is not None]
+    summary = {
+        'requests': len(results),
+        'errors': sum(1 for status, latency, queries in results if status >= 400),
+        'mean_queries': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+    for rank in PERCENTILES:
+        summary['p{}_ms'.format(rank)] = round(percentile(latencies, rank), 2)
+    return summary
+
+
+class Command(BaseCommand):
+    help = ('Replay a weighted mix of page requests and report throughput, latency '
+            'percentiles and queries per request')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Requests sent first and left out of the results')
+        parser.add_argument('--mix', type=parse_mix, default=dict(MIX),
+                            help='Override shares, e.g. "post=50,search=0"')
+        parser.add_argument('--base-url',
+                            help='Send requests to a running server instead of the test client')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Parallel requests, only with --base-url')
+        parser.add_argument('--clear-cache', action='store_true',
+                            help='Start from an empty cache')
+        parser.add_argument('--sample-size', type=int, default=1000,
+                            help='Posts and profiles to draw urls from')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+        parser.add_argument('--compare', help='Results file of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        targets = Targets(rng, options['sample_size'])
+        mix = [(kind, weight) for kind, weight in options['mix'].items()
+               if weight and targets.available(kind)]
+        if not mix:
+            raise CommandError('The request mix is empty')
+        kinds = [kind for kind, weight in mix]
+        weights = [weight for kind, weight in mix]
+
+        if options['base_url']:
+            runner = HttpRunner(options['base_url'], options['concurrency'])
+        elif options['concurrency'] != 1:
+            raise CommandError('--concurrency needs --base-url')
+        else:
+            runner = TestClientRunner()
+
+        if options['clear_cache']:
+            cache.clear()
+
+        plan = [(kind, targets.url(kind))
+                for kind in rng.choices(kinds, weights, k=options['warmup'] + options['requests'])]
+        for kind, url in plan[:options['warmup']]:
+            runner.fetch(url)
+
+        plan = plan[options['warmup']:]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(runner.concurrency) as executor:
+            results = list(executor.map(lambda item: runner.fetch(item[1]), plan))
+        wall = time.perf_counter() - started
+
+        by_kind = defaultdict(list)
+        for (kind, url), result in zip(plan, results):
+            by_kind[kind].append(result)
+        report = {
+            'created': timezone.now().isoformat(),
+            'target': options['base_url'] or 'test client',
+            'concurrency': runner.concurrency,
+            'mix': dict(mix),
+            'wall_s': round(wall, 3),
+            'throughput_rps': round(len(results) / wall, 2),
+            'overall': summarize(results),
+            'kinds': {kind: summarize(by_kind[kind]) for kind in kinds if by_kind[kind]},
+        }
+        self.print_report(report)
+
+        if options['compare']:
+            with open(options['compare']) as previous:
+                self.print_comparison(json.load(previous), report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write('Results written to {}'.format(options['json_path']))
+
+    def print_report(self, report):
+        self.stdout.write('{} requests in {:.2f}s, {:.1f} req/s'.format(
+            report['overall']['requests'], report['wall_s'], report['throughput_rps']))
+        columns = ['requests', 'errors'] + ['p{}_ms'.format(rank) for rank in PERCENTILES]
+        columns += ['mean_queries', 'max_queries']
+        self.stdout.write('{:<8}'.format('kind') + ''.join('{:>13}'.format(c) for c in columns))
+        rows = sorted(report['kinds'].items()) + [('all', report['overall'])]
+        for kind, summary in rows:
+            cells = ['-' if summary[c] is None else summary[c] for c in columns]
+            self.stdout.write('{:<8}'.format(kind) + ''.join('{:>13}'.format(cell) for cell in cells))
+
+    def print_comparison(self, previous, current):
+        self.stdout.write('\nAgainst {} ({}):'.format(previous['created'], previous['target']))
+        self.stdout.write('{:<8}{:>22}{:>22}{:>16}'.format('kind', 'p50_ms', 'p95_ms', 'mean_queries'))
+        rows = [(kind, previous['kinds'].get(kind), summary)
+                for kind, summary in sorted(current['kinds'].items())]
+        rows.append(('all', previous['overall'], current['overall']))
+        for kind, before, after in rows:
+            if before is None:
+                continue
+            cells = []
+            for column in ('p50_ms', 'p95_ms'):
+                change = (after[column] - before[column]) / before[column] * 100 if before[column] else 0
+                cells.append('{:>22}'.format('{} -> {} ({:+.0f}%)'.format(before[column], after[column], change)))
+            cells.append('{:>16}'.format('{} -> {}'.format(before['mean_queries'], after['mean_queries'])))
+            self.stdout.write('{:<8}'.format(kind) + ''.join(cells))
+        self.stdout.write('throughput {} -> {} req/s'.format(
+            previous['throughput_rps'], current['throughput_rps']))
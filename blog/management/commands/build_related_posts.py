@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from blog import related, signals
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related posts of every post from their tags'
+
+    def handle(self, *args, **options):
+        changed = related.rebuild()
+        signals.bump_pages(changed)
+        self.stdout.write('Related posts of {} post(s) changed with {}'.format(
+            len(changed), 'SciPy' if related.sparse is not None else 'the tag index'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from blog import fragments
+
+
+class Command(BaseCommand):
+    help = ('Show hit/miss counters of the post card fragment cache, '
+            'up to BLOG_CARD_STATS_FLUSH seconds behind the running servers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters afterwards')
+
+    def handle(self, *args, **options):
+        stats = fragments.stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0
+        self.stdout.write('hits: {hits}  misses: {misses}'.format(**stats))
+        self.stdout.write('hit ratio: {:.1%}'.format(ratio))
+        if options['reset']:
+            fragments.reset_stats()
@@ -0,0 +1,21 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from blog.transfer import export_posts
+
+
+class Command(BaseCommand):
+    help = 'Write every post as JSON lines, see blog.transfer for the format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='File to write, standard output by default')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            output.writelines(export_posts(chunk_size=options['chunk_size']))
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import related, signals
+from blog.transfer import TransferError, import_posts
+
+
+class Command(BaseCommand):
+    help = 'Create posts from a JSON lines file, see blog.transfer for the format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, "-" for standard input')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Posts created and committed together')
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            lines = sys.stdin
+        else:
+            try:
+                lines = open(options['path'], encoding='utf-8')
+            except OSError as error:
+                raise CommandError(error)
+        try:
+            posts, tags = import_posts(lines, options['batch_size'])
+        except TransferError as error:
+            raise CommandError('Import stopped at {}, earlier batches were kept'.format(error))
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+        # Batches skip the related posts, one pass at the end is cheaper.
+        signals.bump_pages(related.rebuild())
+        self.stdout.write('Imported {} post(s), created {} tag(s)'.format(posts, tags))
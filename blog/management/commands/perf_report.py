@@ -0,0 +1,68 @@
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.perf import PERCENTILES, percentile
+
+
+METRICS = ('total_ms', 'view_ms', 'db_ms', 'template_ms', 'queries')
+
+
+class Command(BaseCommand):
+    help = 'Per url name p50/p95/p99 tables from the blog.perf request log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('logs', nargs='*',
+                            help='Log files to read, defaults to BLOG_PERF_LOG')
+        parser.add_argument('--metric', choices=METRICS, action='append',
+                            help='Metric to report, may be repeated (default: all)')
+        parser.add_argument('--min-count', type=int, default=1,
+                            help='Skip url names with fewer requests')
+
+    def handle(self, *args, **options):
+        samples = defaultdict(lambda: defaultdict(list))
+        skipped = 0
+        paths = options['logs'] or [settings.BLOG_PERF_LOG]
+        if not all(paths):
+            raise CommandError('No log file given and BLOG_PERF_LOG is not set')
+        for path in paths:
+            try:
+                lines = open(path)
+            except OSError as error:
+                raise CommandError('Cannot read {}: {}'.format(path, error))
+            with lines:
+                for line in lines:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    url_name = record.get('url_name') or '<unresolved>'
+                    for metric in METRICS:
+                        if metric in record:
+                            samples[url_name][metric].append(record[metric])
+
+        for metric in options['metric'] or METRICS:
+            self.report(metric, samples, options['min_count'])
+        if skipped:
+            self.stderr.write('Skipped {} unreadable line(s)'.format(skipped))
+
+    def report(self, metric, samples, min_count):
+        rows = []
+        for url_name, metrics in samples.items():
+            values = sorted(metrics[metric])
+            if len(values) >= min_count:
+                rows.append((url_name, len(values)) + tuple(percentile(values, rank) for rank in PERCENTILES))
+        rows.sort(key=lambda row: row[3], reverse=True)
+
+        width = max([len(row[0]) for row in rows] + [len('url name')])
+        header = '{:<{width}} {:>7}'.format('url name', 'count', width=width)
+        header += ''.join(' {:>9}'.format('p{}'.format(rank)) for rank in PERCENTILES)
+        self.stdout.write('\n' + metric)
+        self.stdout.write(header)
+        for url_name, count, *values in rows:
+            line = '{:<{width}} {:>7}'.format(url_name, count, width=width)
+            line += ''.join(' {:>9.1f}'.format(value) for value in values)
+            self.stdout.write(line)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from blog import avatars, utils
+
+
+class Command(BaseCommand):
+    help = 'Create thumbnails for uploaded avatars waiting to be processed'
+
+    def add_arguments(self, parser):
+        utils.add_worker_arguments(parser, 20, 'Keep polling for new uploads instead of exiting')
+
+    def handle(self, *args, **options):
+        utils.run_worker(self.process_batch, options)
+
+    def process_batch(self, batch_size):
+        done, failed = avatars.process_pending(batch_size)
+        if done or failed:
+            self.stdout.write('processed: {}  failed: {}'.format(done, failed))
+        return done + failed
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from blog import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the post search index from scratch'
+
+    def handle(self, *args, **options):
+        search.rebuild_index()
+        self.stdout.write('Indexed posts with {}'.format(
+            type(search.get_backend()).__name__))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+
+from blog import pagecache, signals
+from blog.models import Tag
+
+
+class Command(BaseCommand):
+    help = 'Correct Tag.post_count values that drifted from the real number of posts'
+
+    def handle(self, *args, **options):
+        drifted = (Tag.objects.annotate(actual=Count('posts'))
+                   .exclude(post_count=F('actual'))
+                   .values_list('pk', 'title', 'post_count', 'actual'))
+        fixed = []
+        for pk, title, stored, actual in drifted:
+            Tag.objects.filter(pk=pk).update(post_count=actual)
+            self.stdout.write('{}: {} -> {}'.format(title, stored, actual))
+            fixed.append(pk)
+        if fixed:
+            signals.touch(tag_ids=fixed)
+            signals.bump_pages(tag_ids=fixed, collections=[pagecache.TAG_LIST])
+        self.stdout.write('Reconciled {} tag(s)'.format(len(fixed)))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from blog import pagecache, popularity
+
+
+class Command(BaseCommand):
+    help = 'Recompute the 7 and 30 day post counts of tags, run it daily'
+
+    def handle(self, *args, **options):
+        changed = popularity.refresh()
+        if changed:
+            pagecache.bump([pagecache.TAG_LIST] + [pagecache.tag_dependency(pk) for pk in changed])
+        self.stdout.write('Refreshed {} tag(s)'.format(len(changed)))
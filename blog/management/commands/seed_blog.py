@@ -0,0 +1,161 @@
+import datetime
+import math
+import random
+import time
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from blog import pagecache, popularity, related, search, sitemaps
+from blog.models import Post, Profile, Tag, assign_slugs, make_excerpt
+
+
+WORDS = (
+    'django python query index cache page template view model signal request '
+    'response server client latency throughput database table column row '
+    'cursor search token slug tag post profile avatar image upload storage '
+    'static media session cookie header middleware router worker queue email '
+    'batch stream chunk buffer memory disk network socket thread process '
+    'the a of and to in is it that for on with as was at by this be from or '
+    'have an they which one you were her all she there would their we him '
+    'been has when who will more no if out so said what up its about into '
+    'than them can only other new some could time these two may then do '
+    'first any my now such like our over man me even most made after also'
+).split()
+
+
+def words(rng, count):
+    return ' '.join(rng.choices(WORDS, k=count))
+
+
+def paragraphs(rng, count):
+    text = []
+    while count > 0:
+        size = min(count, rng.randint(40, 120))
+        text.append(words(rng, size).capitalize() + '.')
+        count -= size
+    return '\n\n'.join(text)
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a synthetic corpus of posts, tags and users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--max-tags-per-post', type=int, default=5)
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Exponent of the Zipf distribution tags are drawn from')
+        parser.add_argument('--body-words', type=int, default=300,
+                            help='Median body length in words, lengths are log-normal')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread publication dates over this many past days')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        tag_ids = self.create_tags(options['tags'])
+        post_count = self.create_posts(options, tag_ids)
+        user_count = self.create_users(options['users'])
+
+        popularity.refresh()
+        related.rebuild()
+        search.rebuild_index()
+        pagecache.bump([pagecache.POST_LIST, pagecache.TAG_LIST])
+        sitemaps.bump_all()
+        self.stdout.write('Created {} tag(s), {} post(s) and {} user(s) in {:.1f}s'.format(
+            len(tag_ids), post_count, user_count, time.perf_counter() - started))
+
+    def unique_titles(self, model, count, make_title):
+        taken = set(model.objects.values_list('title', flat=True))
+        titles = []
+        while len(titles) < count:
+            title = make_title()
+            if title not in taken:
+                taken.add(title)
+                titles.append(title)
+        return titles
+
+    def create_tags(self, count):
+        titles = self.unique_titles(Tag, count, lambda: words(self.rng, self.rng.randint(1, 2)))
+        tags = assign_slugs([Tag(title=title) for title in titles])
+        Tag.objects.bulk_create(tags, batch_size=self.batch_size)
+        # Rank order for the Zipf draw, the first tag is the most popular.
+        ids = dict(Tag.objects.filter(title__in=titles).values_list('title', 'pk'))
+        return [ids[title] for title in titles]
+
+    def pick_tags(self, tag_ids, weights, max_tags):
+        picked = set()
+        for _ in range(self.rng.randint(0, max_tags)):
+            picked.add(self.rng.choices(tag_ids, cum_weights=weights)[0])
+        return picked
+
+    def create_posts(self, options, tag_ids):
+        weights = []
+        total = 0.0
+        for rank in range(1, len(tag_ids) + 1):
+            total += 1 / rank ** options['zipf']
+            weights.append(total)
+
+        now = timezone.now()
+        created = 0
+        counts = Counter()
+        while created < options['posts']:
+            size = min(self.batch_size, options['posts'] - created)
+            posts = []
+            for _ in range(size):
+                length = int(self.rng.lognormvariate(math.log(options['body_words']), 0.7)) + 1
+                body = paragraphs(self.rng, min(length, 20 * options['body_words']))
+                posts.append(Post(title=words(self.rng, self.rng.randint(2, 8)).capitalize(),
+                                  body=body, excerpt=make_excerpt(body)))
+            with transaction.atomic():
+                assign_slugs(posts)
+                Post.objects.bulk_create(posts)
+                ids = dict(Post.objects.filter(slug__in=[post.slug for post in posts])
+                           .values_list('slug', 'pk'))
+                links = []
+                for post in posts:
+                    post.pk = ids[post.slug]
+                    # date_pub is auto_now_add, spread the dates afterwards.
+                    post.date_pub = now - datetime.timedelta(
+                        seconds=self.rng.randint(0, options['days'] * 86400))
+                    post.updated_at = post.date_pub
+                    for tag_id in self.pick_tags(tag_ids, weights, options['max_tags_per_post']):
+                        links.append(Post.tags.through(post_id=post.pk, tag_id=tag_id))
+                        counts[tag_id] += 1
+                Post.objects.bulk_update(posts, ['date_pub', 'updated_at'])
+                Post.tags.through.objects.bulk_create(links)
+            created += size
+            self.stdout.write('{} / {} posts'.format(created, options['posts']))
+
+        tags = list(Tag.objects.filter(pk__in=counts))
+        for tag in tags:
+            tag.post_count += counts[tag.pk]
+        Tag.objects.bulk_update(tags, ['post_count'], batch_size=self.batch_size)
+        return created
+
+    def create_users(self, count):
+        # Hashing is slow on purpose, every seeded user shares one hash.
+        password = make_password('password')
+        offset = User.objects.filter(username__startswith='reader').count()
+        usernames = ['reader{:06}'.format(offset + i) for i in range(count)]
+        users = [User(username=username, email='{}@example.com'.format(username),
+                      password=password)
+                 for username in usernames]
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=self.batch_size, ignore_conflicts=True)
+            user_ids = User.objects.filter(username__in=usernames, profile__isnull=True).values_list('pk', flat=True)
+            profiles = [Profile(user_id=pk, email_confirmed=self.rng.random() < 0.8,
+                                bio=words(self.rng, self.rng.randint(0, 40)))
+                        for pk in user_ids]
+            Profile.objects.bulk_create(profiles, batch_size=self.batch_size)
+        return len(profiles)
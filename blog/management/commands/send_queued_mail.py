@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from blog import outbox, utils
+
+
+class Command(BaseCommand):
+    help = 'Send due messages from the email outbox'
+
+    def add_arguments(self, parser):
+        utils.add_worker_arguments(parser, 50,
+                                   'Keep polling the outbox instead of exiting when it is drained')
+
+    def handle(self, *args, **options):
+        utils.run_worker(self.send_batch, options)
+
+    def send_batch(self, batch_size):
+        sent, failed = outbox.send_queued(batch_size)
+        if sent or failed:
+            self.stdout.write('sent: {}  failed: {}'.format(sent, failed))
+        return sent + failed
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from blog import related, signals, utils
+
+
+class Command(BaseCommand):
+    help = 'Update the related posts of posts queued by tag changes'
+
+    def add_arguments(self, parser):
+        utils.add_worker_arguments(parser, 100,
+                                   'Keep polling the queue instead of exiting when it is drained')
+
+    def handle(self, *args, **options):
+        utils.run_worker(self.update_batch, options)
+
+    def update_batch(self, batch_size):
+        taken, changed = related.process_queue(batch_size)
+        if taken:
+            signals.bump_pages(changed)
+            self.stdout.write('updated: {}  changed: {}'.format(taken, len(changed)))
+        return taken
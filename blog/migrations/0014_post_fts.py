@@ -0,0 +1,49 @@
+from django.db import migrations, models, transaction
+from django.db.utils import OperationalError
+
+
+FTS_TABLE = 'blog_post_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    try:
+        with transaction.atomic(using=connection.alias):
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE {} USING fts5("
+                "title, body, tags, tokenize='unicode61 remove_diacritics 2')".format(FTS_TABLE)
+            )
+    except OperationalError:
+        # SQLite built without FTS5: blog.search falls back to its
+        # in-memory index.
+        return
+    schema_editor.execute(
+        "INSERT INTO {} (rowid, title, body, tags) "
+        "SELECT p.id, p.title, p.body, COALESCE(("
+        "SELECT group_concat(t.title, ' ') FROM blog_post_tags pt "
+        "JOIN blog_tag t ON t.id = pt.tag_id WHERE pt.post_id = p.id), '') "
+        "FROM blog_post p".format(FTS_TABLE)
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(FTS_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_auto_20190521_1634'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='body',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
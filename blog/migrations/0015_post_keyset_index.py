@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_post_fts'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='post',
+            options={'ordering': ['-date_pub', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-date_pub', '-id'], name='blog_post_date_pub_id_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:06
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_posts(apps, schema_editor):
+    Tag = apps.get_model('blog', 'Tag')
+    for tag in Tag.objects.annotate(number_of_posts=Count('posts')):
+        Tag.objects.filter(pk=tag.pk).update(post_count=tag.number_of_posts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_post_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:09
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def fill_excerpts(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    for post in Post.objects.only('pk', 'body').iterator():
+        Post.objects.filter(pk=post.pk).update(excerpt=Truncator(post.body).words(15))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0017_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
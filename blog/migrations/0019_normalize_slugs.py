@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def normalize_slugs(apps, schema_editor):
+    for model_name in ('Post', 'Tag'):
+        model = apps.get_model('blog', model_name)
+        max_length = model._meta.get_field('slug').max_length
+        taken = set(model.objects.values_list('slug', flat=True))
+        mixed_case = [(pk, slug) for pk, slug in model.objects.values_list('pk', 'slug')
+                      if slug != slug.lower()]
+        for pk, slug in mixed_case:
+            taken.discard(slug)
+            new_slug = slug.lower()
+            suffix = 2
+            while new_slug in taken:
+                tail = '-{}'.format(suffix)
+                new_slug = slug.lower()[:max_length - len(tail)] + tail
+                suffix += 1
+            taken.add(new_slug)
+            model.objects.filter(pk=pk).update(slug=new_slug)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0018_post_excerpt'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_slugs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0019_normalize_slugs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlugSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=50)),
+                ('base', models.CharField(max_length=150)),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('scope', 'base')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0021_queuedemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+    ]
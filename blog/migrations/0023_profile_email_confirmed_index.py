@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0022_profile_avatar_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='email_confirmed',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:17
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.utils import timezone
+
+
+def count_recent_posts(apps, schema_editor):
+    Tag = apps.get_model('blog', 'Tag')
+    now = timezone.now()
+    tags = Tag.objects.annotate(
+        recent_7d=Count('posts', filter=Q(posts__date_pub__gte=now - datetime.timedelta(days=7))),
+        recent_30d=Count('posts', filter=Q(posts__date_pub__gte=now - datetime.timedelta(days=30))),
+    )
+    for tag in tags:
+        Tag.objects.filter(pk=tag.pk).update(posts_7d=tag.recent_7d, posts_30d=tag.recent_30d)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0023_profile_email_confirmed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='posts_30d',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='posts_7d',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-posts_30d', '-post_count'], name='blog_tag_popularity_idx'),
+        ),
+        migrations.RunPython(count_recent_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0025_related_post'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleRelatedPosts',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tags_changed', models.BooleanField(default=False)),
+                ('queued_at', models.DateTimeField(auto_now_add=True)),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.Post')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def reprocess_kept_uploads(apps, schema_editor):
+    # Avatars processed so far point at the untouched upload, kept as
+    # avatars/<hash>/original.<ext> with its EXIF data.  Marking them
+    # pending makes process_avatars re-encode them and delete the copy.
+    Profile = apps.get_model('blog', 'Profile')
+    Profile.objects.filter(avatar__contains='/original.').update(avatar_hash='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0026_stale_related_posts'),
+    ]
+
+    operations = [
+        migrations.RunPython(reprocess_kept_uploads, migrations.RunPython.noop),
+    ]
@@ -1,35 +1,249 @@
-from django.db import models
+import re
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.fields.files import FieldFile
 from django.shortcuts import reverse
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
-from django.utils.text import slugify
-from time import time
+from django.utils import timezone
+from django.utils.text import slugify, Truncator
+
+
+EXCERPT_WORDS = 15
+
+# Room kept at the end of a slug base for a "-<n>" suffix.
+SLUG_SUFFIX_LENGTH = 8
+
+# Older slugs end in a ten digit timestamp, those never clash with counters.
+LEGACY_SUFFIX = 10 ** 9
+
+SUFFIX_RE = re.compile(r'^(?P<base>.+)-(?P<value>\d+)$')
 
 
-def gen_slug(s):
-    new_slug = slugify(s, allow_unicode=True)
-    return new_slug + '-' + str(int(time()))
+def normalize_slug(slug):
+    """Slugs are stored lower-cased so lookups can use the unique index."""
+    return slug.lower()
 
 
-class Post(models.Model):
+def make_excerpt(body):
+    return Truncator(body).words(EXCERPT_WORDS)
+
+
+class SlugSequence(models.Model):
+    """Last suffix handed out for a slug base of one model."""
+    scope = models.CharField(max_length=50)
+    base = models.CharField(max_length=150)
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('scope', 'base')
+
+    def __str__(self):
+        return '{}:{}'.format(self.scope, self.base)
+
+
+def slug_base(model, title):
+    max_length = model._meta.get_field('slug').max_length - SLUG_SUFFIX_LENGTH
+    base = normalize_slug(slugify(title, allow_unicode=True))[:max_length].strip('-')
+    return base or model._meta.model_name
+
+
+def format_slug(base, value):
+    """
+    The first slug of a base is the bare base, later ones get "-2", "-3"...
+    Bases that already end in "-<digits>" always get a suffix, so "top-10"
+    from "Top 10" can never clash with the tenth "Top".
+    """
+    if value == 1 and not SUFFIX_RE.match(base):
+        return base
+    return '{}-{}'.format(base, value)
+
+
+def _highest_value(model, base):
+    """Highest counter value already taken by rows of ``model`` for ``base``."""
+    # A range rather than startswith, which SQLite cannot serve from the
+    # slug index: "base-" <= slug < "base." ("." follows "-").
+    slugs = (model.objects.filter(Q(slug=base) | Q(slug__gte=base + '-', slug__lt=base + '.'))
+             .values_list('slug', flat=True))
+    highest = 0
+    for slug in slugs:
+        if slug == base:
+            # A base like "top-10" is never handed out bare, see format_slug.
+            if not SUFFIX_RE.match(base):
+                highest = max(highest, 1)
+            continue
+        match = SUFFIX_RE.match(slug)
+        if match and match.group('base') == base and int(match.group('value')) < LEGACY_SUFFIX:
+            highest = max(highest, int(match.group('value')))
+    return highest
+
+
+def _reserve(model, base, count):
+    """Reserve ``count`` consecutive values for ``base``, return the first."""
+    scope = model._meta.label_lower
+    sequence = SlugSequence.objects.filter(scope=scope, base=base)
+    with transaction.atomic():
+        if not sequence.update(last_value=F('last_value') + count):
+            # First use of this base: the existing rows are scanned once to
+            # seed the counter, afterwards it is the only source of truth.
+            _, created = SlugSequence.objects.get_or_create(
+                scope=scope, base=base,
+                defaults={'last_value': lambda: _highest_value(model, base) + count})
+            if not created:
+                sequence.update(last_value=F('last_value') + count)
+        last_value = sequence.values_list('last_value', flat=True).get()
+    return last_value - count + 1
+
+
+def allocate_slugs(model, titles):
+    """
+    Unique slugs for ``titles`` in one go.  Every distinct base costs one
+    counter update, however many slugs are taken from it.
+    """
+    bases = [slug_base(model, title) for title in titles]
+    next_values = {base: _reserve(model, base, count)
+                   for base, count in Counter(bases).items()}
+    slugs = []
+    for base in bases:
+        slugs.append(format_slug(base, next_values[base]))
+        next_values[base] += 1
+    return slugs
+
+
+def assign_slugs(objs):
+    """
+    Give every object without a slug a unique one; the bulk path for
+    ``bulk_create``, which never calls ``save()``.
+    """
+    objs = list(objs)
+    missing = [obj for obj in objs if not obj.slug]
+    if missing:
+        model = type(missing[0])
+        for obj, slug in zip(missing, allocate_slugs(model, [obj.title for obj in missing])):
+            obj.slug = slug
+    for obj in objs:
+        obj.slug = normalize_slug(obj.slug)
+    return objs
+
+
+def claim_slug(model, slug):
+    """
+    Move the counter of ``slug``'s base past a hand-picked slug.  A base
+    without a counter gets one right away, so slugs allocated before the
+    row is written, as in a bulk import, cannot take it.
+    """
+    match = SUFFIX_RE.match(slug)
+    if match:
+        base, value = match.group('base'), int(match.group('value'))
+        if value >= LEGACY_SUFFIX:
+            return
+    else:
+        base, value = slug, 1
+    scope = model._meta.label_lower
+    with transaction.atomic():
+        _, created = SlugSequence.objects.get_or_create(
+            scope=scope, base=base,
+            defaults={'last_value': lambda: max(_highest_value(model, base), value)})
+        if not created:
+            (SlugSequence.objects.filter(scope=scope, base=base, last_value__lt=value)
+             .update(last_value=value))
+
+
+class ChangeTrackingModel(models.Model):
+    """
+    Remembers the values a row was loaded with so ``save()`` only writes
+    the fields that changed since, and nothing at all when none did.
+
+    Fields named in ``untracked_fields`` are never written by a plain save
+    of an existing row; ``auto_now`` fields go along with any other change.
+    """
+    untracked_fields = ()
+    _loaded_values = None
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self._remember_values(fields)
+
+    def _remember_values(self, fields=None):
+        if self._loaded_values is None:
+            self._loaded_values = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.name in fields):
+                value = self.__dict__[field.attname]
+                # File objects change in place, keep their name instead.
+                if isinstance(value, FieldFile):
+                    value = value.name
+                self._loaded_values[field.attname] = value
+
+    def loaded_value(self, name):
+        return (self._loaded_values or {}).get(self._meta.get_field(name).attname)
+
+    def changed_fields(self):
+        """Names of the concrete fields that differ from the loaded row."""
+        changed = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if (field.attname not in self._loaded_values
+                    or self.__dict__[field.attname] != self._loaded_values[field.attname]):
+                changed.append(field.name)
+        return changed
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and self._loaded_values is not None
+                and kwargs.get('update_fields') is None and not kwargs.get('force_insert')):
+            changed = [name for name in self.changed_fields() if name not in self.untracked_fields]
+            if changed:
+                changed += [field.name for field in self._meta.concrete_fields
+                            if getattr(field, 'auto_now', False) and field.name not in changed]
+            # An empty list makes Django skip the query and the signals.
+            kwargs['update_fields'] = changed
+        super().save(*args, **kwargs)
+        self._remember_values()
+
+
+class Post(ChangeTrackingModel):
     title = models.CharField(max_length=150, db_index=True)
     slug = models.SlugField(max_length=150, blank=True, unique=True)
-    body = models.TextField(blank=True, db_index=True)
+    body = models.TextField(blank=True)
+    # Filled in save() so list pages can defer the body.
+    excerpt = models.TextField(blank=True, editable=False)
     date_pub = models.DateTimeField(auto_now_add=True)
+    # Also bumped by blog.signals when the post's tags change or are renamed.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     tags = models.ManyToManyField('Tag', blank=True, related_name='posts')
 
 
     class Meta:
-        ordering = ['-date_pub']
+        ordering = ['-date_pub', '-id']
+        indexes = [
+            models.Index(fields=['-date_pub', '-id'], name='blog_post_date_pub_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
     def save(self, *args, **kwargs):
         if not self.id or not self.slug:
-            self.slug = gen_slug(self.title)
+            self.slug = allocate_slugs(Post, [self.title])[0]
+        elif self.slug != self.loaded_value('slug'):
+            claim_slug(Post, normalize_slug(self.slug))
+        self.slug = normalize_slug(self.slug)
+        if 'body' not in self.get_deferred_fields():
+            self.excerpt = make_excerpt(self.body)
         super().save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -42,11 +256,7 @@ class Post(models.Model):
         return reverse('post_delete_url', kwargs={'slug': self.slug})
 
     def shorted_body(self):
-        if len(self.body.split(' '))>5:
-            shorted = ''.join(word + ' ' for word in self.body.split(' ')[:5])
-            return shorted + '...'
-        else:
-            return self.body
+        return Truncator(self.excerpt).words(5, truncate='...')
 
     shorted_body.short_description = 'Body'
 
@@ -56,20 +266,36 @@ class Post(models.Model):
     display_tags.short_description = 'Tags'
 
 
-class Tag(models.Model):
+class Tag(ChangeTrackingModel):
     title = models.CharField(max_length=50, unique=True)
     slug = models.SlugField(max_length=50, blank=True, unique=True)
-
+    # Maintained by blog.signals, see the reconcile_tag_counts command.
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    # Posts published within the last 7 and 30 days, see blog.popularity.
+    posts_7d = models.PositiveIntegerField(default=0, editable=False)
+    posts_30d = models.PositiveIntegerField(default=0, editable=False)
+    # Also bumped by blog.signals when posts join or leave the tag.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # The counters only move through F() updates, a stale in-memory value
+    # must never be written back.
+    untracked_fields = ('post_count', 'posts_7d', 'posts_30d')
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['-posts_30d', '-post_count'], name='blog_tag_popularity_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
     def save(self, *args, **kwargs):
         if not self.id or not self.slug:
-            self.slug = gen_slug(self.title)
+            self.slug = allocate_slugs(Tag, [self.title])[0]
+        elif self.slug != self.loaded_value('slug'):
+            claim_slug(Tag, normalize_slug(self.slug))
+        self.slug = normalize_slug(self.slug)
         super().save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -82,17 +308,56 @@ class Tag(models.Model):
         return reverse('tag_delete_url', kwargs={'slug': self.slug})
 
 
-class Profile(models.Model):
+class RelatedPost(models.Model):
+    """One of the ``BLOG_RELATED_POSTS`` nearest neighbours of a post, see blog.related."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_posts')
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_from')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('post', 'related')
+        indexes = [
+            models.Index(fields=['post', '-score'], name='blog_relatedpost_rank_idx'),
+        ]
+
+    def __str__(self):
+        return '{} -> {}'.format(self.post_id, self.related_id)
+
+
+class StaleRelatedPosts(models.Model):
+    """A post whose related posts wait for the update_related_posts worker."""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='+')
+    # Its own tags changed, so other posts' lists may have to take it in.
+    tags_changed = models.BooleanField(default=False)
+    queued_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return str(self.post_id)
+
+
+class Profile(ChangeTrackingModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    email_confirmed = models.BooleanField(default=False)
+    email_confirmed = models.BooleanField(default=False, db_index=True)
     bio = models.TextField(max_length=400, blank=True)
     location = models.CharField(max_length=40, blank=True)
     birth_date = models.DateField(null=True, blank=True)
     avatar = models.ImageField(upload_to='profiles/', default = "/profiles/None/default.png")
+    # Content hash of the processed avatar, empty while processing is
+    # pending (see blog.avatars).
+    avatar_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+
+    AVATAR_FAILED = '-'
 
     def __str__(self):
         return self.user.username
 
+    @property
+    def avatar_processed(self):
+        return self.avatar_hash not in ('', self.AVATAR_FAILED)
+
     def get_absolute_url(self):
         return reverse('user_profile_url', kwargs={'pk': self.user.pk})
 
@@ -100,8 +365,49 @@ class Profile(models.Model):
         return reverse('user_profile_edit_url', kwargs={'pk': self.user.pk})
 
 
+class QueuedEmail(models.Model):
+    """An outgoing email waiting for the send_queued_mail worker."""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.TextField(help_text='Comma separated recipients')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['send_after', 'id']
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='blog_queuedemail_due_idx'),
+        ]
+
+    def __str__(self):
+        return '{} -> {}'.format(self.subject, self.to)
+
+    @property
+    def recipients(self):
+        return [address for address in self.to.split(',') if address]
+
+
 @receiver(post_save, sender=User)
 def update_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
-    instance.profile.save()
+    elif User.profile.is_cached(instance):
+        # Only a profile reached through this user object can hold unsaved
+        # changes, e.g. email_confirmed in activate().  Plain user saves,
+        # like the last_login update on every login, leave it alone.
+        instance.profile.save()
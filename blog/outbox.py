@@ -0,0 +1,97 @@
+"""
+Persistent outbox for email.
+
+Requests only ``enqueue`` messages; the ``send_queued_mail`` command sends
+due messages in batches over one SMTP connection, retrying failures with
+exponential backoff up to ``BLOG_OUTBOX_MAX_ATTEMPTS`` times.  Run a single
+worker: due rows are not locked against concurrent workers.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils import timezone
+
+from .models import QueuedEmail
+
+
+def enqueue(subject, body, to, from_email=None, html_body=''):
+    return QueuedEmail.objects.create(
+        subject=subject,
+        body=body,
+        html_body=html_body or '',
+        from_email=from_email or '',
+        to=','.join(to),
+    )
+
+
+def _message(email, connection):
+    message = EmailMultiAlternatives(
+        email.subject, email.body, email.from_email or None, email.recipients,
+        connection=connection
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def _retry_delay(attempts):
+    return datetime.timedelta(seconds=settings.BLOG_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def _record_failure(email, error):
+    email.attempts += 1
+    email.last_error = repr(error)
+    if email.attempts >= settings.BLOG_OUTBOX_MAX_ATTEMPTS:
+        email.status = QueuedEmail.FAILED
+    else:
+        email.send_after = timezone.now() + _retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'send_after'])
+
+
+def _reconnect(connection):
+    """(Re)open ``connection``, return the error when the server cannot be reached."""
+    try:
+        connection.close()
+        connection.open()
+    except Exception as error:
+        return error
+    return None
+
+
+def send_queued(batch_size=50):
+    """Send one batch of due messages, return ``(sent, failed)`` counts."""
+    due = list(QueuedEmail.objects.filter(status=QueuedEmail.PENDING,
+                                          send_after__lte=timezone.now())[:batch_size])
+    if not due:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection()
+    error = _reconnect(connection)
+    try:
+        for email in due:
+            if error is not None:
+                # No server to talk to, the rest of the batch backs off too.
+                _record_failure(email, error)
+                failed += 1
+                continue
+            try:
+                _message(email, connection).send()
+            except Exception as send_error:
+                _record_failure(email, send_error)
+                failed += 1
+                # The server may have dropped us, start the next send afresh.
+                error = _reconnect(connection)
+            else:
+                email.status = QueuedEmail.SENT
+                email.sent_at = timezone.now()
+                email.attempts += 1
+                email.save(update_fields=['status', 'sent_at', 'attempts'])
+                sent += 1
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return sent, failed
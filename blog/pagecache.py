@@ -0,0 +1,123 @@
+"""
+Full-page cache for anonymous readers.
+
+A cached page remembers the generation of every dependency it was rendered
+from: ``post:<id>``, ``tag:<id>`` or one of the collections below.  Changes
+to posts and tags bump exactly the dependencies they affect (see
+``blog.signals``), and a page whose recorded generations no longer match is
+rendered again.  Pages also expire after ``BLOG_PAGE_CACHE_TIMEOUT`` seconds.
+
+Requests carrying a session cookie and responses that set cookies or use the
+CSRF token are never served from or stored in the cache.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+
+
+POST_LIST = 'post-list'
+TAG_LIST = 'tag-list'
+PROFILE_LIST = 'profile-list'
+
+
+def post_dependency(pk):
+    return 'post:{}'.format(pk)
+
+
+def tag_dependency(pk):
+    return 'tag:{}'.format(pk)
+
+
+def instance_dependency(obj):
+    return '{}:{}'.format(obj._meta.model_name, obj.pk)
+
+
+def _generation_key(dependency):
+    return 'blog:page-gen:' + dependency
+
+
+def _page_key(request):
+    path = request.get_full_path().encode()
+    return 'blog:page:' + hashlib.md5(path).hexdigest()
+
+
+def generations(dependencies):
+    """Current generation of each dependency, starting new ones as needed."""
+    keys = {dependency: _generation_key(dependency) for dependency in dependencies}
+    found = cache.get_many(list(keys.values()))
+    new = {}
+    for key in keys.values():
+        if key not in found:
+            found[key] = new[key] = uuid.uuid4().hex
+    if new:
+        cache.set_many(new, None)
+    return {dependency: found[key] for dependency, key in keys.items()}
+
+
+def bump(dependencies):
+    """Invalidate every cached page rendered from ``dependencies``."""
+    cache.delete_many([_generation_key(dependency) for dependency in dependencies])
+
+
+def depend_on(request, *dependencies):
+    """Record that the page being rendered for ``request`` uses ``dependencies``."""
+    recorded = getattr(request, '_page_dependencies', None)
+    if recorded is not None:
+        missing = [dependency for dependency in dependencies if dependency not in recorded]
+        if missing:
+            recorded.update(generations(missing))
+
+
+def _is_fresh(recorded):
+    keys = [_generation_key(dependency) for dependency in recorded]
+    current = cache.get_many(keys)
+    return all(current.get(_generation_key(dependency)) == generation
+               for dependency, generation in recorded.items())
+
+
+def _cacheable_request(request):
+    return (request.method in ('GET', 'HEAD')
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES)
+
+
+def _cacheable_response(request, response):
+    return (response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_USED')
+            and 'private' not in response.get('Cache-Control', '')
+            and 'no-store' not in response.get('Cache-Control', ''))
+
+
+def cache_anonymous_page(view):
+    """
+    Serve ``view`` from the page cache for anonymous requests.
+
+    The view declares what it renders with ``depend_on``; pages without any
+    dependency are not stored.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if not _cacheable_request(request):
+            return view(request, *args, **kwargs)
+
+        key = _page_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            recorded, response = entry
+            if _is_fresh(recorded):
+                return response
+
+        request._page_dependencies = {}
+        response = view(request, *args, **kwargs)
+        patch_vary_headers(response, ('Cookie',))
+        if request._page_dependencies and _cacheable_response(request, response):
+            cache.set(key, (request._page_dependencies, response),
+                      settings.BLOG_PAGE_CACHE_TIMEOUT)
+        return response
+
+    return wrapped
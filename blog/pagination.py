@@ -0,0 +1,145 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the position of their first or last row instead of
+an offset, so every page is one indexed range scan of ``per_page + 1`` rows
+and no ``COUNT(*)`` is issued.  Cursors are opaque url-safe tokens.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def _encode(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class CursorPage:
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` on ``ordering``, which must be a total order (end
+    it with a unique field such as ``-pk``).  Field names may follow
+    relations, e.g. ``user__username``.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-date_pub', '-pk')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def _model_field(self, name):
+        model = self.queryset.model
+        parts = name.split('__')
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).related_model
+        if parts[-1] == 'pk':
+            return model._meta.pk
+        return model._meta.get_field(parts[-1])
+
+    def _value(self, obj, name):
+        for part in name.split('__'):
+            obj = getattr(obj, part)
+        return obj
+
+    def encode_cursor(self, obj, backwards=False):
+        position = [_encode(self._value(obj, name)) for name in self.fields]
+        data = json.dumps(['p' if backwards else 'n', position], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Return ``(backwards, values)`` or ``None`` for a malformed cursor."""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if direction not in ('n', 'p') or len(position) != len(self.fields):
+                return None
+            values = [self._model_field(name).to_python(value)
+                      for name, value in zip(self.fields, position)]
+        except (ValueError, TypeError, binascii.Error, ValidationError):
+            return None
+        return direction == 'p', values
+
+    def _after(self, values, backwards):
+        """Q for rows strictly past ``values`` in the walking direction."""
+        condition = Q()
+        for index, name in reversed(list(enumerate(self.ordering))):
+            descending = name.startswith('-') != backwards
+            lookup = '{}__{}'.format(self.fields[index], 'lt' if descending else 'gt')
+            step = Q(**{lookup: values[index]})
+            if index < len(self.ordering) - 1:
+                step |= Q(**{self.fields[index]: values[index]}) & condition
+            condition = step
+        return condition
+
+    def page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        backwards = False
+        queryset = self.queryset
+        if decoded:
+            backwards, values = decoded
+            queryset = queryset.filter(self._after(values, backwards))
+        ordering = self.ordering
+        if backwards:
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in ordering]
+
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or backwards:
+                next_cursor = self.encode_cursor(rows[-1])
+            if has_more if backwards else decoded:
+                previous_cursor = self.encode_cursor(rows[0], backwards=True)
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+
+def page_url(request, key, value):
+    """Current query string with ``key`` replaced by ``value``."""
+    if value is None:
+        return ''
+    query = request.GET.copy()
+    query[key] = value
+    return '?' + query.urlencode()
+
+
+def cursor_page_context(request, queryset, per_page, **kwargs):
+    page = CursorPaginator(queryset, per_page, **kwargs).page(request.GET.get('cursor'))
+    return {
+        'page_object': page,
+        'is_paginated': page.has_other_pages(),
+        'prev_url': page_url(request, 'cursor', page.previous_cursor),
+        'next_url': page_url(request, 'cursor', page.next_cursor),
+    }
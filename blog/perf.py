@@ -0,0 +1,152 @@
+"""
+Per-request timings.
+
+``PerformanceMiddleware`` measures every request: SQL query count and time
+(through ``connection.execute_wrapper``), template rendering time (through
+the ``TimedDjangoTemplates`` backend) and the time spent in the view.  The
+numbers go out as a ``Server-Timing`` header when ``BLOG_SERVER_TIMING`` is
+on and as one JSON line per request on the ``blog.perf`` logger, written to
+``BLOG_PERF_LOG`` when that is set, which the ``perf_report`` command turns
+into percentile tables.
+"""
+import json
+import logging
+import math
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+
+logger = logging.getLogger('blog.perf')
+
+_local = threading.local()
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, rank):
+    """Nearest-rank percentile of sorted ``values``."""
+    return values[max(0, math.ceil(rank / 100 * len(values)) - 1)]
+
+
+QUERIES_DESC = 'queries'
+SERVER_TIMING_QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) {}"'.format(QUERIES_DESC))
+
+
+def server_timing_queries(header):
+    """Query count reported in a ``Server-Timing`` header, or ``None``."""
+    match = SERVER_TIMING_QUERIES_RE.search(header or '')
+    return int(match.group(1)) if match else None
+
+
+class RequestTimings:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.view_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+        self.template_ms = 0.0
+        self.template_depth = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - started) * 1000
+            self.queries += 1
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+def current():
+    """Timings of the request being handled by this thread, or ``None``."""
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timed_template():
+    timings = current()
+    if timings is None or timings.template_depth:
+        # Templates rendered from within another one are already counted.
+        yield
+        return
+    timings.template_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.template_ms += (time.perf_counter() - started) * 1000
+        timings.template_depth -= 1
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with timed_template():
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with rendering time added to the request."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class PerformanceMiddleware:
+    """Keep it first in MIDDLEWARE so the total covers the whole stack."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = _local.timings = RequestTimings()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.record_query))
+                response = self.get_response(request)
+            if timings.view_started is not None:
+                timings.view_ms = (time.perf_counter() - timings.view_started) * 1000
+            total_ms = timings.total_ms()
+        finally:
+            _local.timings = None
+
+        if settings.BLOG_SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                'db;dur={:.1f};desc="{} {}"'.format(timings.db_ms, timings.queries, QUERIES_DESC),
+                'tpl;dur={:.1f}'.format(timings.template_ms),
+                'view;dur={:.1f}'.format(timings.view_ms),
+                'total;dur={:.1f}'.format(total_ms),
+            ])
+        match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'time': round(time.time(), 3),
+            'url_name': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'view_ms': round(timings.view_ms, 2),
+            'db_ms': round(timings.db_ms, 2),
+            'queries': timings.queries,
+            'template_ms': round(timings.template_ms, 2),
+        }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current()
+        if timings is not None:
+            timings.view_started = time.perf_counter()
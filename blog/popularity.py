@@ -0,0 +1,66 @@
+"""
+Rolling activity counters on ``Tag``.
+
+``posts_7d`` and ``posts_30d`` count the tag's posts published within the
+window.  Tagging and untagging recent posts moves them right away (see
+``blog.signals``); as posts age out of a window nothing happens, so the
+``refresh_tag_popularity`` command recomputes them, run it daily.
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import Post, Tag
+
+
+WINDOWS = (
+    ('posts_7d', 7),
+    ('posts_30d', 30),
+)
+
+
+def _cutoff(days, now=None):
+    return (now or timezone.now()) - datetime.timedelta(days=days)
+
+
+def shift_recent_counts(links, sign, dates=None):
+    """
+    Move the window counters of the tags in ``links``, ``(post_id, tag_id)``
+    pairs, by ``sign`` where the post is recent.  ``dates`` maps post ids to
+    their ``date_pub`` and is read from the database when not given.
+    """
+    now = timezone.now()
+    if dates is None:
+        post_ids = {post_id for post_id, tag_id in links}
+        dates = dict(Post.objects.filter(pk__in=post_ids, date_pub__gte=_cutoff(30, now))
+                     .values_list('pk', 'date_pub'))
+    for field, days in WINDOWS:
+        cutoff = _cutoff(days, now)
+        tag_ids = [tag_id for post_id, tag_id in links
+                   if post_id in dates and dates[post_id] >= cutoff]
+        by_delta = defaultdict(list)
+        for tag_id, occurrences in Counter(tag_ids).items():
+            by_delta[sign * occurrences].append(tag_id)
+        for delta, ids in by_delta.items():
+            Tag.objects.filter(pk__in=ids).update(**{field: F(field) + delta})
+
+
+def refresh():
+    """Recompute every window counter, return the ids of tags that moved."""
+    now = timezone.now()
+    counts = {
+        field: Count('posts', filter=Q(posts__date_pub__gte=_cutoff(days, now)))
+        for field, days in WINDOWS
+    }
+    fields = [field for field, days in WINDOWS]
+    current = Tag.objects.annotate(**{'actual_' + field: count for field, count in counts.items()})
+
+    changed = []
+    for row in current.values('pk', *fields, *['actual_' + field for field in fields]):
+        actual = {field: row['actual_' + field] for field in fields}
+        if any(row[field] != actual[field] for field in fields):
+            Tag.objects.filter(pk=row['pk']).update(updated_at=now, **actual)
+            changed.append(row['pk'])
+    return changed
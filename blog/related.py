@@ -0,0 +1,260 @@
+"""
+Precomputed related posts.
+
+Posts are compared by their tags: each tag weighs ``log(1 + posts / tag
+posts)``, so sharing a rare tag counts for more than sharing a common one,
+and two posts score the cosine of their weighted tag vectors.  The best
+``BLOG_RELATED_POSTS`` of every post are kept in ``RelatedPost`` rows, and
+``PostDetail`` only reads those.
+
+``rebuild`` computes the whole table, with a sparse post x tag matrix
+product when SciPy is installed and through an inverted tag index
+otherwise; run the ``build_related_posts`` command after imports and now
+and then to follow the drift of tag weights.
+
+Edits never compute anything in the request: ``blog.signals`` only
+``enqueue`` the posts whose tags changed, and the ``update_related_posts``
+worker feeds them to ``update_posts``, which recomputes only the lists
+those posts can enter or leave.  Id lists are sent to the database in
+chunks of ``CHUNK_SIZE``, a popular tag has more posts than SQLite takes
+query parameters.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Post, RelatedPost, StaleRelatedPosts
+from .utils import chunks
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+BLOCK_SIZE = 1000
+CHUNK_SIZE = 500
+# Scores are compared at this precision to tell a list apart from its rows.
+PRECISION = 6
+
+
+class TagGraph:
+    """Tags of a set of posts and the posts of each of those tags."""
+
+    def __init__(self, links, total):
+        self.tags_of = defaultdict(set)
+        self.posts_of = defaultdict(set)
+        self.weights = {}
+        for post_id, tag_id, post_count in links:
+            self.tags_of[post_id].add(tag_id)
+            self.posts_of[tag_id].add(post_id)
+            self.weights[tag_id] = math.log1p(total / max(post_count, 1))
+        self.norms = {
+            post_id: math.sqrt(sum(self.weights[tag_id] ** 2 for tag_id in tag_ids))
+            for post_id, tag_ids in self.tags_of.items()
+        }
+
+    @classmethod
+    def around(cls, post_ids):
+        """Graph covering ``post_ids`` and every post sharing a tag with them."""
+        through = Post.tags.through.objects
+        tag_ids = through.filter(post_id__in=post_ids).values('tag_id')
+        neighbours = through.filter(tag_id__in=tag_ids).values('post_id')
+        return cls(through.filter(post_id__in=neighbours)
+                   .values_list('post_id', 'tag_id', 'tag__post_count'),
+                   Post.objects.count())
+
+    @classmethod
+    def everything(cls):
+        return cls(Post.tags.through.objects.values_list('post_id', 'tag_id', 'tag__post_count'),
+                   Post.objects.count())
+
+    def scores(self, post_id):
+        """Similarity of ``post_id`` to every other post sharing a tag."""
+        shared = defaultdict(float)
+        for tag_id in self.tags_of.get(post_id, ()):
+            weight = self.weights[tag_id] ** 2
+            for other in self.posts_of[tag_id]:
+                shared[other] += weight
+        shared.pop(post_id, None)
+        norm = self.norms.get(post_id)
+        return {other: value / (norm * self.norms[other]) for other, value in shared.items()}
+
+
+def top(scores, k):
+    """The ``k`` best ``(post_id, score)`` pairs, newer posts winning ties."""
+    best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], item[0]))
+    return [(post_id, round(score, PRECISION)) for post_id, score in best]
+
+
+def _matrix_tops(graph, post_ids, k):
+    """``top`` for every post of the graph from a sparse matrix product."""
+    row_of = {post_id: row for row, post_id in enumerate(post_ids)}
+    column_of = {tag_id: column for column, tag_id in enumerate(graph.weights)}
+    rows, columns, values = [], [], []
+    for post_id, tag_ids in graph.tags_of.items():
+        for tag_id in tag_ids:
+            rows.append(row_of[post_id])
+            columns.append(column_of[tag_id])
+            values.append(graph.weights[tag_id] / graph.norms[post_id])
+    matrix = sparse.csr_matrix((values, (rows, columns)), shape=(len(post_ids), len(column_of)))
+    transposed = matrix.T.tocsr()
+
+    for start in range(0, len(post_ids), BLOCK_SIZE):
+        block = (matrix[start:start + BLOCK_SIZE] @ transposed).tocsr()
+        for offset in range(block.shape[0]):
+            row = start + offset
+            lo, hi = block.indptr[offset], block.indptr[offset + 1]
+            others, similarity = block.indices[lo:hi], block.data[lo:hi]
+            keep = others != row
+            others, similarity = others[keep], similarity[keep]
+            if len(similarity) > k:
+                # Keep the ties at the cut for ``top`` to settle.
+                cut = numpy.partition(similarity, len(similarity) - k)[len(similarity) - k]
+                keep = similarity >= cut
+                others, similarity = others[keep], similarity[keep]
+            scores = {post_ids[other]: float(value) for other, value in zip(others, similarity)}
+            yield post_ids[row], top(scores, k)
+
+
+def _tops(graph, post_ids, k):
+    if sparse is not None and len(post_ids) > BLOCK_SIZE:
+        return _matrix_tops(graph, post_ids, k)
+    return ((post_id, top(graph.scores(post_id), k)) for post_id in post_ids)
+
+
+def _current(post_ids):
+    current = defaultdict(list)
+    for chunk in chunks(post_ids, CHUNK_SIZE):
+        rows = (RelatedPost.objects.filter(post_id__in=chunk)
+                .order_by('post_id', '-score', '-related_id')
+                .values_list('post_id', 'related_id', 'score'))
+        for post_id, related_id, score in rows:
+            current[post_id].append((related_id, round(score, PRECISION)))
+    return current
+
+
+def _store(lists):
+    """
+    Write the ``{post_id: [(related_id, score)]}`` lists that differ from
+    their rows, return the ids of posts whose related posts changed.
+    """
+    current = _current(list(lists))
+    stale = [post_id for post_id, pairs in lists.items() if current.get(post_id, []) != pairs]
+    if not stale:
+        return []
+    moved = [post_id for post_id in stale
+             if [pk for pk, score in current.get(post_id, [])] != [pk for pk, score in lists[post_id]]]
+    now = timezone.now()
+    with transaction.atomic():
+        for chunk in chunks(stale, CHUNK_SIZE):
+            RelatedPost.objects.filter(post_id__in=chunk).delete()
+        RelatedPost.objects.bulk_create([
+            RelatedPost(post_id=post_id, related_id=related_id, score=score)
+            for post_id in stale for related_id, score in lists[post_id]
+        ], batch_size=CHUNK_SIZE)
+        for chunk in chunks(moved, CHUNK_SIZE):
+            Post.objects.filter(pk__in=chunk).update(updated_at=now)
+    return moved
+
+
+def rebuild():
+    """Recompute every list, return the ids of posts whose related posts changed."""
+    k = settings.BLOG_RELATED_POSTS
+    # Whatever was queued so far is covered, later edits stay queued.
+    StaleRelatedPosts.objects.filter(queued_at__lte=timezone.now()).delete()
+    graph = TagGraph.everything()
+    post_ids = sorted(graph.tags_of)
+    moved = []
+    lists = {}
+    for post_id, pairs in _tops(graph, post_ids, k):
+        lists[post_id] = pairs
+        if len(lists) == BLOCK_SIZE:
+            moved += _store(lists)
+            lists = {}
+    moved += _store(lists)
+
+    # Posts that lost all their tags keep no related posts.
+    untagged = list(RelatedPost.objects.filter(post__tags=None)
+                    .values_list('post_id', flat=True).distinct())
+    if untagged:
+        moved += _store({post_id: [] for post_id in untagged})
+    return moved
+
+
+def update_posts(post_ids):
+    """
+    Follow a change of the tags of ``post_ids``: recompute their lists and
+    the lists of other posts they may have entered or left.  Tag weights are
+    taken as they are, ``rebuild`` catches up with their drift.  Return the
+    ids of posts whose related posts changed.
+    """
+    if not post_ids:
+        return []
+    k = settings.BLOG_RELATED_POSTS
+    changed = set(post_ids)
+    graph = TagGraph.around(list(changed))
+    scores = {post_id: graph.scores(post_id) for post_id in changed}
+    lists = {post_id: top(scores[post_id], k) for post_id in changed}
+
+    # Scores are symmetric, so the changed posts' scores tell which other
+    # lists they now beat.  Lists that held one of them are redone anyway.
+    entering = defaultdict(float)
+    for post_id in changed:
+        for other, score in scores[post_id].items():
+            if other not in changed:
+                entering[other] = max(entering[other], round(score, PRECISION))
+    holders = set(RelatedPost.objects.filter(related_id__in=changed)
+                  .exclude(post_id__in=changed).values_list('post_id', flat=True))
+    current = _current(list(entering))
+    redo = holders | {
+        other for other, score in entering.items()
+        if len(current.get(other, [])) < k or score >= current[other][-1][1]
+    }
+
+    return _store(lists) + recompute(redo)
+
+
+def recompute(post_ids):
+    """Recompute the lists of ``post_ids``, return the ones that changed."""
+    k = settings.BLOG_RELATED_POSTS
+    moved = []
+    for chunk in chunks(post_ids, CHUNK_SIZE):
+        graph = TagGraph.around(chunk)
+        moved += _store({post_id: top(graph.scores(post_id), k) for post_id in chunk})
+    return moved
+
+
+def enqueue(post_ids, tags_changed=False):
+    """
+    Queue ``post_ids`` for ``process_queue``; with ``tags_changed`` the
+    lists of other posts are checked against them too.
+    """
+    for chunk in chunks(post_ids, CHUNK_SIZE):
+        StaleRelatedPosts.objects.bulk_create(
+            [StaleRelatedPosts(post_id=post_id, tags_changed=tags_changed) for post_id in chunk],
+            ignore_conflicts=True)
+        if tags_changed:
+            (StaleRelatedPosts.objects.filter(post_id__in=chunk, tags_changed=False)
+             .update(tags_changed=True))
+
+
+def process_queue(batch_size=100):
+    """
+    Update the lists of one batch of queued posts, return how many were
+    taken and the ids of posts whose related posts changed.
+    """
+    rows = list(StaleRelatedPosts.objects.values_list('pk', 'post_id', 'tags_changed')
+                [:batch_size])
+    if not rows:
+        return 0, []
+    # Taken off first, a post queued again meanwhile is seen next time.
+    StaleRelatedPosts.objects.filter(pk__in=[pk for pk, post_id, tags_changed in rows]).delete()
+    changed = [post_id for pk, post_id, tags_changed in rows if tags_changed]
+    unchanged = [post_id for pk, post_id, tags_changed in rows if not tags_changed]
+    return len(rows), update_posts(changed) + recompute(unchanged)
@@ -0,0 +1,387 @@
+"""
+Full-text search over posts.
+
+Two backends share one interface.  ``Fts5Backend`` keeps the SQLite FTS5
+table ``blog_post_fts`` (created by migration 0014) in sync with ``Post``
+rows.  ``MemoryBackend`` is a pure-Python inverted index for databases
+without FTS5.  It lives in the process that built it: the signals update it
+there and publish the changed post ids in a ``ChangeLog``, which the other
+processes read at most every ``BLOG_SEARCH_RECHECK`` seconds to re-index
+those posts.
+
+Both match whole tokens and token prefixes ("djan" finds "django"), require
+every query token to match (AND) and order results by relevance.
+"""
+import hashlib
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+
+from .changelog import ChangeLog
+from .models import Post
+from .utils import chunks
+
+
+FTS_TABLE = 'blog_post_fts'
+
+# Relative weights of the indexed columns: title, body, tags.
+FIELD_WEIGHTS = (10.0, 1.0, 5.0)
+
+INDEX_CHUNK_SIZE = 500
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Split ``text`` into case- and accent-folded tokens."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return TOKEN_RE.findall(text)
+
+
+def _post_documents(post_ids):
+    """Yield ``(id, title, body, tags)`` for the given posts."""
+    tags = defaultdict(list)
+    through = Post.tags.through.objects.filter(post_id__in=post_ids)
+    for post_id, title in through.values_list('post_id', 'tag__title'):
+        tags[post_id].append(title)
+
+    rows = Post.objects.filter(pk__in=post_ids).values_list('pk', 'title', 'body')
+    for pk, title, body in rows:
+        yield pk, title, body, ' '.join(tags[pk])
+
+
+class SearchResults:
+    """
+    Lazy, ranked result set for one query.
+
+    Supports ``count()`` and slicing, so it can be handed to
+    ``django.core.paginator.Paginator`` like a queryset.  Slicing runs one
+    ranked id lookup against the index plus one query for the posts and one
+    for their tags.
+    """
+    ordered = True
+
+    def __init__(self, backend, terms):
+        self.backend = backend
+        self.terms = terms
+
+    def count(self, limit=None):
+        """Number of matches, stopping at ``limit`` when it is given."""
+        if not self.terms:
+            return 0
+        return self.backend.count(self.terms, limit)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        if key.stop is None:
+            limit = None
+        else:
+            limit = max(key.stop - start, 0)
+        if not self.terms or limit == 0:
+            return []
+        ids = self.backend.ranked_ids(self.terms, start, limit)
+        posts = Post.objects.defer('body').prefetch_related('tags').in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+class Fts5Backend:
+    """Search backed by an SQLite FTS5 virtual table."""
+
+    @staticmethod
+    def available():
+        if connection.vendor != 'sqlite':
+            return False
+        return FTS_TABLE in connection.introspection.table_names()
+
+    def _match_expression(self, terms):
+        # Tokens only contain word characters, quoting them keeps FTS5
+        # operators typed by users from being interpreted.
+        return ' '.join('"{}"*'.format(term) for term in terms)
+
+    def count(self, terms, limit=None):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {table} MATCH %s '
+                'LIMIT %s)'.format(table=FTS_TABLE),
+                [self._match_expression(terms), -1 if limit is None else limit]
+            )
+            return cursor.fetchone()[0]
+
+    def ranked_ids(self, terms, offset=0, limit=None):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+                'ORDER BY bm25({table}, %s, %s, %s), rowid DESC '
+                'LIMIT %s OFFSET %s'.format(table=FTS_TABLE),
+                [self._match_expression(terms), *FIELD_WEIGHTS,
+                 -1 if limit is None else limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index(self, post_ids):
+        for chunk in chunks(post_ids, INDEX_CHUNK_SIZE):
+            self.remove(chunk)
+            documents = list(_post_documents(chunk))
+            if not documents:
+                continue
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    'INSERT INTO {} (rowid, title, body, tags) '
+                    'VALUES (%s, %s, %s, %s)'.format(FTS_TABLE),
+                    documents
+                )
+
+    def remove(self, post_ids):
+        for chunk in chunks(post_ids, INDEX_CHUNK_SIZE):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'DELETE FROM {} WHERE rowid IN ({})'.format(
+                        FTS_TABLE, ', '.join(['%s'] * len(chunk))),
+                    chunk
+                )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        ids = Post.objects.order_by('pk').values_list('pk', flat=True)
+        self.index(ids.iterator())
+
+
+class MemoryBackend:
+    """
+    Pure-Python inverted index, built from the database on first use.
+
+    Postings map a token to ``{post_id: weighted term frequency}``; a sorted
+    token list answers prefix lookups with ``bisect``.
+    """
+
+    changes = ChangeLog('search')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        # Number of the last change applied.
+        self._position = 0
+        self._checked = 0.0
+        self._postings = {}
+        self._doc_terms = {}
+        self._sorted_terms = []
+
+    def _ensure_current(self):
+        now = time.monotonic()
+        if self._built and now - self._checked < settings.BLOG_SEARCH_RECHECK:
+            return
+        with self._lock:
+            self._checked = now
+            published = self.changes.since(self._position) if self._built else None
+            if published is None:
+                self.rebuild()
+                return
+            self._position, entries = published
+            for op, post_ids in entries:
+                if op == 'index':
+                    self._index(post_ids)
+                else:
+                    self._remove(post_ids)
+
+    def rebuild(self):
+        with self._lock:
+            # Changes published while loading are replayed on top.
+            self._position = self.changes.sequence()
+            self._checked = time.monotonic()
+            self._postings = {}
+            self._doc_terms = {}
+            self._sorted_terms = []
+            ids = Post.objects.order_by('pk').values_list('pk', flat=True)
+            self._built = True
+            self._index(ids.iterator())
+
+    def _add_document(self, pk, *fields):
+        frequencies = defaultdict(float)
+        for weight, text in zip(FIELD_WEIGHTS, fields):
+            for term in tokenize(text):
+                frequencies[term] += weight
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._sorted_terms.insert(bisect_left(self._sorted_terms, term), term)
+            postings[pk] = frequency
+        self._doc_terms[pk] = set(frequencies)
+
+    def _remove_document(self, pk):
+        for term in self._doc_terms.pop(pk, ()):
+            postings = self._postings[term]
+            postings.pop(pk, None)
+            if not postings:
+                del self._postings[term]
+                del self._sorted_terms[bisect_left(self._sorted_terms, term)]
+
+    def _index(self, post_ids):
+        with self._lock:
+            for chunk in chunks(post_ids, INDEX_CHUNK_SIZE):
+                for pk in chunk:
+                    self._remove_document(pk)
+                for pk, title, body, tags in _post_documents(chunk):
+                    self._add_document(pk, title, body, tags)
+
+    def _remove(self, post_ids):
+        with self._lock:
+            for pk in post_ids:
+                self._remove_document(pk)
+
+    def index(self, post_ids):
+        post_ids = list(post_ids)
+        if self._built:
+            self._index(post_ids)
+        self.changes.publish(('index', post_ids))
+
+    def remove(self, post_ids):
+        post_ids = list(post_ids)
+        if self._built:
+            self._remove(post_ids)
+        self.changes.publish(('remove', post_ids))
+
+    def _expand(self, term):
+        position = bisect_left(self._sorted_terms, term)
+        while (position < len(self._sorted_terms)
+               and self._sorted_terms[position].startswith(term)):
+            yield self._sorted_terms[position]
+            position += 1
+
+    def _scores(self, terms):
+        self._ensure_current()
+        with self._lock:
+            total = len(self._doc_terms) or 1
+            scores = None
+            for term in terms:
+                term_scores = defaultdict(float)
+                for candidate in self._expand(term):
+                    postings = self._postings[candidate]
+                    idf = math.log(1 + total / len(postings))
+                    # Whole-token matches outrank prefix-only matches.
+                    boost = 2.0 if candidate == term else 1.0
+                    for pk, frequency in postings.items():
+                        term_scores[pk] += boost * idf * frequency / (frequency + 1.2)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pk: score + term_scores[pk]
+                              for pk, score in scores.items() if pk in term_scores}
+                if not scores:
+                    return {}
+            return scores or {}
+
+    def count(self, terms, limit=None):
+        total = len(self._scores(terms))
+        return total if limit is None else min(total, limit)
+
+    def ranked_ids(self, terms, offset=0, limit=None):
+        scores = self._scores(terms)
+        ranked = sorted(scores, key=lambda pk: (-scores[pk], -pk))
+        end = None if limit is None else offset + limit
+        return ranked[offset:end]
+
+
+class SearchPaginator(Paginator):
+    """
+    Paginator over ``SearchResults`` that counts as little as possible.
+
+    The page is fetched first with one extra row, so an empty or single-page
+    result never needs a count.  Otherwise the count is cached per normalized
+    query for ``BLOG_SEARCH_COUNT_TTL`` seconds, and is capped at
+    ``BLOG_SEARCH_COUNT_LIMIT``: larger result sets report the cap with
+    ``estimated`` set and only the capped results are paginated.
+    """
+
+    def __init__(self, object_list, per_page, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.estimated = False
+
+    def _count_cache_key(self):
+        query = ' '.join(self.object_list.terms)
+        return 'blog:search-count:' + hashlib.md5(query.encode()).hexdigest()
+
+    @cached_property
+    def count(self):
+        key = self._count_cache_key()
+        cached = cache.get(key)
+        if cached is None:
+            limit = settings.BLOG_SEARCH_COUNT_LIMIT
+            total = self.object_list.count(limit=limit + 1)
+            cached = (min(total, limit), total > limit)
+            cache.set(key, cached, settings.BLOG_SEARCH_COUNT_TTL)
+        count, self.estimated = cached
+        return count
+
+    def get_page(self, number):
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        if number > 1 and number > self.num_pages:
+            # Past the last page, or past the cap of an estimated count.
+            number = self.num_pages
+        rows = self._fetch(number)
+        if number == 1 and len(rows) <= self.per_page:
+            # The first fetch saw every match.
+            self.__dict__['count'] = len(rows)
+        elif self.estimated:
+            rows = rows[:self.count - (number - 1) * self.per_page]
+        return self._get_page(rows[:self.per_page], number, self)
+
+    def _fetch(self, number):
+        bottom = (number - 1) * self.per_page
+        return self.object_list[bottom:bottom + self.per_page + 1]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the configured backend, picking FTS5 when ``auto`` allows it."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'BLOG_SEARCH_BACKEND', 'auto')
+                if name == 'fts5' or (name == 'auto' and Fts5Backend.available()):
+                    _backend = Fts5Backend()
+                else:
+                    _backend = MemoryBackend()
+    return _backend
+
+
+def search_posts(query):
+    return SearchResults(get_backend(), tokenize(query))
+
+
+def index_posts(post_ids):
+    if post_ids:
+        get_backend().index(post_ids)
+
+
+def remove_posts(post_ids):
+    if post_ids:
+        get_backend().remove(post_ids)
+
+
+def rebuild_index():
+    get_backend().rebuild()
@@ -0,0 +1,199 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Post, Profile, Tag
+from . import autocomplete, conditional, fragments, pagecache, popularity, related, search, sitemaps
+
+
+def invalidate(func, *args):
+    """
+    Run a cache invalidation now and again once the transaction commits, so
+    a concurrent render that still read the old rows cannot stay cached.
+    """
+    func(*args)
+    transaction.on_commit(lambda: func(*args))
+
+
+def tag_post_ids(tag):
+    return list(Post.tags.through.objects.filter(tag_id=tag.pk)
+                .values_list('post_id', flat=True))
+
+
+def post_tag_ids(post_ids):
+    return list(Post.tags.through.objects.filter(post_id__in=post_ids)
+                .values_list('tag_id', flat=True).distinct())
+
+
+def bump_pages(post_ids=(), tag_ids=(), collections=()):
+    dependencies = list(collections)
+    dependencies += [pagecache.post_dependency(pk) for pk in post_ids]
+    dependencies += [pagecache.tag_dependency(pk) for pk in tag_ids]
+    # Every change that reaches a page also moves the row's lastmod.
+    dependencies += {sitemaps.shard_dependency('posts', pk) for pk in post_ids}
+    dependencies += {sitemaps.shard_dependency('tags', pk) for pk in tag_ids}
+    invalidate(pagecache.bump, dependencies)
+
+
+def touch(post_ids=(), tag_ids=()):
+    """Move ``updated_at`` of rows whose rendering changed without a save."""
+    now = timezone.now()
+    if post_ids:
+        Post.objects.filter(pk__in=post_ids).update(updated_at=now)
+    if tag_ids:
+        Tag.objects.filter(pk__in=tag_ids).update(updated_at=now)
+
+
+def title_changed(instance):
+    return (instance.title, instance.slug) != (instance.loaded_value('title'),
+                                               instance.loaded_value('slug'))
+
+
+def changed_links(instance, action, reverse, pk_set):
+    """
+    ``(post_id, tag_id)`` pairs that an ``m2m_changed`` call on ``Post.tags``
+    creates or deletes.
+
+    The pairs are worked out in the ``pre_*`` step, while rows about to be
+    removed or cleared can still be read (``pk_set`` of a remove also names
+    rows that do not exist), and handed back again in the ``post_*`` step.
+    """
+    if action.startswith('post_'):
+        return getattr(instance, '_changed_links', [])
+
+    if action == 'pre_add':
+        # Django has already dropped the ids that were linked before.
+        if reverse:
+            pairs = [(pk, instance.pk) for pk in pk_set]
+        else:
+            pairs = [(instance.pk, pk) for pk in pk_set]
+    else:
+        rows = Post.tags.through.objects.all()
+        if reverse:
+            rows = rows.filter(tag_id=instance.pk)
+            if action == 'pre_remove':
+                rows = rows.filter(post_id__in=pk_set)
+        else:
+            rows = rows.filter(post_id=instance.pk)
+            if action == 'pre_remove':
+                rows = rows.filter(tag_id__in=pk_set)
+        pairs = list(rows.values_list('post_id', 'tag_id'))
+    instance._changed_links = pairs
+    return pairs
+
+
+def shift_post_counts(tag_ids, sign):
+    """Move ``Tag.post_count`` by ``sign`` for every occurrence of a tag id."""
+    by_delta = defaultdict(list)
+    for tag_id, occurrences in Counter(tag_ids).items():
+        by_delta[sign * occurrences].append(tag_id)
+    for delta, ids in by_delta.items():
+        Tag.objects.filter(pk__in=ids).update(post_count=F('post_count') + delta)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    search.index_posts([instance.pk])
+    post_ids = [instance.pk]
+    if title_changed(instance):
+        invalidate(conditional.forget_slugs, Post, [instance.slug, instance.loaded_value('slug')])
+        invalidate(autocomplete.put_posts, [instance])
+        # Pages listing it among their related posts show the title too.
+        post_ids += list(instance.related_from.values_list('post_id', flat=True))
+    invalidate(fragments.bump_versions, [instance.pk])
+    bump_pages(post_ids, post_tag_ids([instance.pk]), [pagecache.POST_LIST])
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    # Through rows are deleted without m2m_changed, count them out here.
+    instance._deleted_tag_ids = post_tag_ids([instance.pk])
+    instance._related_holder_ids = list(instance.related_from.values_list('post_id', flat=True))
+    # Lists that showed the post take the next best one.
+    related.enqueue(instance._related_holder_ids)
+    shift_post_counts(instance._deleted_tag_ids, -1)
+    popularity.shift_recent_counts([(instance.pk, tag_id) for tag_id in instance._deleted_tag_ids],
+                                   -1, {instance.pk: instance.date_pub})
+    touch(tag_ids=instance._deleted_tag_ids)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    search.remove_posts([instance.pk])
+    invalidate(conditional.forget_slugs, Post, [instance.slug])
+    invalidate(autocomplete.index.remove, 'post', [instance.pk])
+    bump_pages([instance.pk] + getattr(instance, '_related_holder_ids', []),
+               getattr(instance, '_deleted_tag_ids', []),
+               [pagecache.POST_LIST, pagecache.TAG_LIST])
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    links = changed_links(instance, action, reverse, pk_set)
+    if not action.startswith('post_') or not links:
+        return
+    post_ids = sorted({post_id for post_id, tag_id in links})
+    tag_ids = [tag_id for post_id, tag_id in links]
+
+    sign = 1 if action == 'post_add' else -1
+    shift_post_counts(tag_ids, sign)
+    popularity.shift_recent_counts(links, sign, None if reverse else {instance.pk: instance.date_pub})
+    touch(post_ids, set(tag_ids))
+    search.index_posts(post_ids)
+    invalidate(fragments.bump_versions, post_ids)
+    bump_pages(post_ids, set(tag_ids), [pagecache.POST_LIST, pagecache.TAG_LIST])
+    related.enqueue(post_ids, tags_changed=True)
+
+
+def tag_renamed(tag, post_ids):
+    """Refresh everything that shows the title of ``tag`` on ``post_ids``."""
+    touch(post_ids)
+    search.index_posts(post_ids)
+    invalidate(fragments.bump_versions, post_ids)
+    # Cards on other tags' pages list this tag too.
+    tag_ids = post_tag_ids(post_ids) + [tag.pk]
+    bump_pages(post_ids, tag_ids, [pagecache.POST_LIST, pagecache.TAG_LIST])
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    # The slug may have been taken or given up, see conditional.slug_id.
+    invalidate(conditional.forget_slugs, Tag, [instance.slug, instance.loaded_value('slug')])
+    if title_changed(instance):
+        invalidate(autocomplete.put_tags, [instance])
+    if created:
+        bump_pages(tag_ids=[instance.pk], collections=[pagecache.TAG_LIST])
+        return
+    tag_renamed(instance, tag_post_ids(instance))
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting(sender, instance, **kwargs):
+    # The through rows are gone by post_delete, remember who used the tag.
+    instance._deleted_post_ids = tag_post_ids(instance)
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    invalidate(conditional.forget_slugs, Tag, [instance.slug])
+    invalidate(autocomplete.index.remove, 'tag', [instance.pk])
+    post_ids = getattr(instance, '_deleted_post_ids', [])
+    tag_renamed(instance, post_ids)
+    related.enqueue(post_ids, tags_changed=True)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def profile_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate(pagecache.bump, [pagecache.PROFILE_LIST,
+                                sitemaps.shard_dependency('profiles', instance.pk)])
@@ -0,0 +1,208 @@
+"""
+Sharded sitemap.
+
+``/sitemap.xml`` is a sitemap index pointing at one shard per
+``BLOG_SITEMAP_SHARD_SIZE`` primary keys of posts, tags and confirmed
+profiles (``/sitemap-posts-0.xml`` covers posts 1 to 10000 and so on).
+A shard is read in keyset chunks and kept in the anonymous page cache
+under its own dependency, which ``blog.signals`` bumps only when a row in
+its range changes.  Shards remember their newest ``lastmod`` for the
+index, and both are served with ETags taken from the cache generations.
+"""
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+
+from .conditional import conditional
+from .models import Post, Profile, Tag
+from .pagecache import (POST_LIST, PROFILE_LIST, TAG_LIST, bump, cache_anonymous_page, depend_on,
+                        generations)
+from .utils import PLACEHOLDER
+
+
+CHUNK_SIZE = 2000
+CONTENT_TYPE = 'application/xml'
+
+
+def shard_of(pk):
+    return (pk - 1) // settings.BLOG_SITEMAP_SHARD_SIZE
+
+
+def _dependency(section, shard):
+    return 'sitemap:{}:{}'.format(section, shard)
+
+
+def shard_dependency(section, pk):
+    """Page-cache dependency of the shard holding ``pk``."""
+    return _dependency(section, shard_of(pk))
+
+
+def _lastmod_key(section, shard, generation):
+    return 'blog:sitemap-lastmod:{}:{}:{}'.format(section, shard, generation)
+
+
+def _w3c(value):
+    return value.replace(microsecond=0).isoformat()
+
+
+class Section:
+    model = None
+    url_name = None
+    collection = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def queryset(self):
+        return self.model.objects.all()
+
+    def rows(self, shard):
+        """``(pk, url_value, lastmod)`` of the shard, read in keyset chunks."""
+        size = settings.BLOG_SITEMAP_SHARD_SIZE
+        last_pk, end = shard * size, (shard + 1) * size
+        while True:
+            chunk = list(self.queryset().filter(pk__gt=last_pk, pk__lte=end)
+                         .order_by('pk').values_list(*self.columns)[:CHUNK_SIZE])
+            yield from chunk
+            if len(chunk) < CHUNK_SIZE:
+                return
+            last_pk = chunk[-1][0]
+
+    def shard_count(self):
+        highest = self.queryset().aggregate(highest=Max('pk'))['highest']
+        return shard_of(highest) + 1 if highest else 0
+
+    def location_pattern(self):
+        # Reversing once and filling in the value keeps big shards cheap.
+        return reverse(self.url_name, kwargs={self.url_kwarg: PLACEHOLDER}).replace(PLACEHOLDER, '{}')
+
+
+class PostSection(Section):
+    model = Post
+    url_name = 'post_detail_url'
+    url_kwarg = 'slug'
+    columns = ('pk', 'slug', 'updated_at')
+    collection = POST_LIST
+
+
+class TagSection(Section):
+    model = Tag
+    url_name = 'tag_detail_url'
+    url_kwarg = 'slug'
+    columns = ('pk', 'slug', 'updated_at')
+    collection = TAG_LIST
+
+
+class ProfileSection(Section):
+    model = Profile
+    url_name = 'user_profile_url'
+    url_kwarg = 'pk'
+    columns = ('pk', 'user_id')
+    collection = PROFILE_LIST
+
+    def queryset(self):
+        return Profile.objects.filter(email_confirmed=True)
+
+
+SECTIONS = {
+    'posts': PostSection('posts'),
+    'tags': TagSection('tags'),
+    'profiles': ProfileSection('profiles'),
+}
+
+COLLECTIONS = [section.collection for section in SECTIONS.values()]
+
+
+def bump_all():
+    """Invalidate every shard, after rows were written around the signals."""
+    dependencies = [_dependency(section.name, shard) for section in SECTIONS.values()
+                    for shard in range(section.shard_count())]
+    bump(dependencies + COLLECTIONS)
+
+
+def index_validator(request):
+    return None, sorted(generations(COLLECTIONS).items())
+
+
+def _existing_shard(section, shard):
+    """The ``Section`` named ``section`` if it has ``shard``, else ``None``."""
+    section = SECTIONS.get(section)
+    if section is None or shard >= section.shard_count():
+        # Checked before touching generations, so made-up shard numbers
+        # never start cache entries.
+        return None
+    return section
+
+
+def shard_validator(request, section, shard):
+    if _existing_shard(section, shard) is None:
+        return None
+    dependency = _dependency(section, shard)
+    return None, generations([dependency])[dependency]
+
+
+@conditional(index_validator)
+@cache_anonymous_page
+def index(request):
+    depend_on(request, *COLLECTIONS)
+    entries = []
+    for section in SECTIONS.values():
+        dependencies = [_dependency(section.name, shard)
+                        for shard in range(section.shard_count())]
+        current = generations(dependencies)
+        lastmods = cache.get_many([_lastmod_key(section.name, shard, current[dependency])
+                                   for shard, dependency in enumerate(dependencies)])
+        for shard, dependency in enumerate(dependencies):
+            location = request.build_absolute_uri(
+                reverse('sitemap_shard_url', kwargs={'section': section.name, 'shard': shard}))
+            lastmod = lastmods.get(_lastmod_key(section.name, shard, current[dependency]))
+            entries.append('<sitemap><loc>{}</loc>{}</sitemap>'.format(
+                escape(location), '<lastmod>{}</lastmod>'.format(lastmod) if lastmod else ''))
+
+    body = ''.join([
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n',
+        '\n'.join(entries),
+        '\n</sitemapindex>\n',
+    ])
+    return HttpResponse(body, content_type=CONTENT_TYPE)
+
+
+@conditional(shard_validator)
+@cache_anonymous_page
+def shard(request, section, shard):
+    section = _existing_shard(section, shard)
+    if section is None:
+        raise Http404('No such sitemap shard')
+    dependency = _dependency(section.name, shard)
+    generation = generations([dependency])[dependency]
+    depend_on(request, dependency)
+
+    base = request.build_absolute_uri('/').rstrip('/')
+    pattern = section.location_pattern()
+    urls = []
+    newest = None
+    for pk, value, *lastmod in section.rows(shard):
+        location = escape(base + pattern.format(quote(str(value))))
+        if lastmod:
+            newest = max(newest, lastmod[0]) if newest else lastmod[0]
+            urls.append('<url><loc>{}</loc><lastmod>{}</lastmod></url>'.format(
+                location, _w3c(lastmod[0])))
+        else:
+            urls.append('<url><loc>{}</loc></url>'.format(location))
+
+    if newest:
+        cache.set(_lastmod_key(section.name, shard, generation), _w3c(newest),
+                  settings.BLOG_PAGE_CACHE_TIMEOUT)
+    body = ''.join([
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n',
+        '\n'.join(urls),
+        '\n</urlset>\n',
+    ])
+    return HttpResponse(body, content_type=CONTENT_TYPE)
@@ -0,0 +1,19 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from blog import avatars, fragments
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts):
+    return mark_safe(fragments.render_cards(posts))
+
+
+@register.inclusion_tag('blog/includes/avatar.html')
+def avatar(profile, size, css_class='img-fluid'):
+    context = avatars.avatar_urls(profile, size)
+    context['css_class'] = css_class
+    return context
@@ -1,3 +1,1012 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from django_blog import static_wsgi
+from . import (autocomplete, avatars, conditional, fragments, outbox, pagecache, perf, related,
+               search, sitemaps, transfer)
+from .forms import TagForm
+from .models import Post, Profile, QueuedEmail, SlugSequence, Tag, assign_slugs
+from .pagination import CursorPaginator
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class BlogTestCase(TestCase):
+    """
+    Several tests clear the cache, keep them all off the site's one, and
+    keep test requests out of the request log ``perf_report`` reads.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._perf_handlers, perf.logger.handlers = perf.logger.handlers, [logging.NullHandler()]
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        perf.logger.handlers = cls._perf_handlers
+
+
+class QueryBudgetTests(BlogTestCase):
+    """List views must issue a fixed number of queries whatever the page size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [Tag.objects.create(title='tag {}'.format(i)) for i in range(3)]
+        for i in range(30):
+            post = Post.objects.create(title='post {}'.format(i), body='searchable body')
+            post.tags.set(cls.tags[:1 + i % 3])
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        for i in range(30):
+            user = User.objects.create_user('reader{:02}'.format(i))
+            Profile.objects.filter(user=user).update(email_confirmed=i % 2 == 0)
+
+    def assertQueryBudget(self, url, budget):
+        # From a cold cache, so budgets include the Last-Modified aggregate.
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries), budget,
+            '{} ran {} queries:\n{}'.format(
+                url, len(queries), '\n'.join(query['sql'] for query in queries))
+        )
+
+    def assertPagedQueryBudget(self, url, budget, page_sizes=(3, 25),
+                               setting='BLOG_POSTS_PER_PAGE'):
+        for per_page in page_sizes:
+            with self.settings(**{setting: per_page}):
+                self.assertQueryBudget(url, budget)
+
+    def test_posts_list(self):
+        self.assertPagedQueryBudget(reverse('posts_list_url'), 3)
+
+    def test_posts_list_search(self):
+        self.assertPagedQueryBudget(reverse('posts_list_url') + '?search=searchable', 5)
+
+    def test_tag_detail(self):
+        self.assertPagedQueryBudget(self.tags[0].get_absolute_url(), 5)
+
+    def test_api_posts(self):
+        self.assertPagedQueryBudget(reverse('api_posts_url'), 3, setting='BLOG_API_PAGE_SIZE')
+
+    @override_settings(BLOG_API_STREAM_THRESHOLD=5, BLOG_API_STREAM_CHUNK=4)
+    def test_api_posts_streamed(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api_posts_url'), {'limit': 25})
+            data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['results']), 25)
+        self.assertEqual([len(item['tags']) for item in data['results']][:3], [3, 2, 1])
+        self.assertEqual(len(queries), 3)
+
+    def test_tags_list(self):
+        self.assertQueryBudget(reverse('tags_list_url'), 2)
+        self.assertQueryBudget(reverse('tags_list_url') + '?sort=popular', 2)
+
+    def test_profiles_list(self):
+        self.assertPagedQueryBudget(reverse('profiles_list_url'), 1,
+                                    setting='BLOG_PROFILES_PER_PAGE')
+
+    def test_profiles_list_filters(self):
+        url = reverse('profiles_list_url')
+        response = self.client.get(url, {'username': 'reader0', 'status': 'unconfirmed'})
+        self.assertEqual([profile.user.username for profile in response.context['page_object']],
+                         ['reader00', 'reader02', 'reader04', 'reader06', 'reader08'])
+
+        self.client.force_login(self.admin)
+        response = self.client.get(url, {'username': 'reader0', 'status': 'unconfirmed'})
+        self.assertEqual([profile.user.username for profile in response.context['page_object']],
+                         ['reader01', 'reader03', 'reader05', 'reader07', 'reader09'])
+
+    def test_admin_post_changelist(self):
+        self.client.force_login(self.admin)
+        self.assertQueryBudget(reverse('admin:blog_post_changelist'), 7)
+
+
+class PerformanceMiddlewareTests(BlogTestCase):
+
+    @override_settings(BLOG_SERVER_TIMING=True)
+    def test_server_timing_header_matches_the_log_line(self):
+        cache.clear()
+        with self.assertLogs('blog.perf', 'INFO') as logs:
+            response = self.client.get(reverse('tags_list_url'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record['url_name'], record['status']), ('tags_list_url', 200))
+        self.assertEqual(perf.server_timing_queries(response['Server-Timing']), record['queries'])
+        self.assertGreater(record['queries'], 0)
+
+    @override_settings(BLOG_SERVER_TIMING=False)
+    def test_server_timing_can_be_turned_off(self):
+        with self.assertLogs('blog.perf', 'INFO'):
+            response = self.client.get(reverse('tags_list_url'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_perf_report_percentiles(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as log:
+            self.addCleanup(os.remove, log.name)
+            for total in range(1, 101):
+                log.write(json.dumps({'url_name': 'post_detail_url', 'total_ms': total}) + '\n')
+            log.write('not json\n')
+        out, err = io.StringIO(), io.StringIO()
+        call_command('perf_report', log.name, metric=['total_ms'], stdout=out, stderr=err)
+        row = [line for line in out.getvalue().splitlines() if line.startswith('post_detail_url')]
+        self.assertEqual(row[0].split(), ['post_detail_url', '100', '50.0', '95.0', '99.0'])
+        self.assertIn('Skipped 1', err.getvalue())
+
+
+class ConditionalGetTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(title='validated')
+        cls.post = Post.objects.create(title='validated post')
+        cls.post.tags.add(cls.tag)
+        # Last-Modified has a one second resolution.
+        an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        Post.objects.update(updated_at=an_hour_ago)
+        Tag.objects.update(updated_at=an_hour_ago)
+
+    def urls(self):
+        return [reverse('posts_list_url'), self.post.get_absolute_url(),
+                reverse('tags_list_url'), self.tag.get_absolute_url(), reverse('api_posts_url')]
+
+    def test_matching_etag_gets_304_without_queries(self):
+        for url in self.urls():
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_edit_moves_the_etags_of_dependent_pages(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls()}
+        self.post.title = 'edited'
+        self.post.save()
+        statuses = {url: self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+                    for url, etag in etags.items()}
+        self.assertEqual(statuses, {
+            reverse('posts_list_url'): 200, self.post.get_absolute_url(): 200,
+            reverse('tags_list_url'): 304, self.tag.get_absolute_url(): 200,
+            reverse('api_posts_url'): 200,
+        })
+
+    def test_if_modified_since_gets_304_without_queries(self):
+        cache.clear()
+        for url in self.urls():
+            last_modified = self.client.get(url)['Last-Modified']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_edit_moves_last_modified_of_dependent_pages(self):
+        cache.clear()
+        dates = {url: self.client.get(url)['Last-Modified'] for url in self.urls()}
+        self.post.title = 'retitled'
+        self.post.save()
+        statuses = {url: self.client.get(url, HTTP_IF_MODIFIED_SINCE=date).status_code
+                    for url, date in dates.items()}
+        self.assertEqual(statuses, {
+            reverse('posts_list_url'): 200, self.post.get_absolute_url(): 200,
+            reverse('tags_list_url'): 304, self.tag.get_absolute_url(): 200,
+            reverse('api_posts_url'): 200,
+        })
+
+    def test_unknown_slug_has_no_etag(self):
+        response = self.client.get(reverse('post_detail_url', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertIsNone(cache.get(conditional._slug_key(Post, 'missing')))
+
+
+class SaveQueryTests(BlogTestCase):
+    """Saves write only what changed and leave untouched rows alone."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('writer', 'writer@example.com', 'password')
+        cls.tag = Tag.objects.create(title='tag')
+        cls.post = Post.objects.create(title='post', body='first body')
+        cls.post.tags.set([cls.tag])
+
+    def capture(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = func(*args, **kwargs)
+        return response, [query['sql'] for query in queries]
+
+    def writes(self, queries, table):
+        return [sql for sql in queries
+                if sql.startswith(('UPDATE "{}"'.format(table), 'INSERT INTO "{}"'.format(table)))]
+
+    def test_login(self):
+        response, queries = self.capture(self.client.post, reverse('login'),
+                                         {'username': 'writer', 'password': 'password'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse([sql for sql in queries if 'blog_profile' in sql], queries)
+        self.assertLessEqual(len(queries), 9, '\n'.join(queries))
+
+    def test_profile_edit(self):
+        self.client.force_login(self.user)
+        data = {'first_name': '', 'last_name': '', 'email': 'writer@example.com',
+                'bio': 'new bio', 'location': '', 'birth_date': '', 'save': ''}
+        response, queries = self.capture(
+            self.client.post, reverse('user_profile_edit_url', kwargs={'pk': self.user.pk}), data)
+        self.assertEqual(response.status_code, 302)
+        profile_writes = self.writes(queries, 'blog_profile')
+        self.assertEqual(len(profile_writes), 1, queries)
+        self.assertIn('"bio"', profile_writes[0])
+        self.assertNotIn('"location"', profile_writes[0])
+        self.assertLessEqual(len(queries), 12, '\n'.join(queries))
+
+    def test_post_edit(self):
+        self.client.force_login(self.user)
+        data = {'title': 'renamed', 'slug': self.post.slug, 'body': 'first body',
+                'tags': [self.tag.pk]}
+        response, queries = self.capture(self.client.post, self.post.get_update_url(), data)
+        self.assertEqual(response.status_code, 302)
+        post_writes = self.writes(queries, 'blog_post')
+        self.assertEqual(len(post_writes), 1, queries)
+        self.assertIn('"title"', post_writes[0])
+        self.assertNotIn('"body"', post_writes[0])
+        self.assertFalse(self.writes(queries, 'blog_tag'), queries)
+        self.assertLessEqual(len(queries), 16, '\n'.join(queries))
+
+    def test_unchanged_save_is_skipped(self):
+        post = Post.objects.get(pk=self.post.pk)
+        _, queries = self.capture(post.save)
+        self.assertEqual(queries, [])
+
+
+class TagCountTests(BlogTestCase):
+
+    def setUp(self):
+        self.django, self.python = Tag.objects.create(title='django'), Tag.objects.create(title='python')
+        self.first, self.second = Post.objects.create(title='first'), Post.objects.create(title='second')
+
+    def counts(self):
+        return dict(Tag.objects.values_list('title', 'post_count'))
+
+    def test_post_count_follows_links(self):
+        self.first.tags.add(self.django, self.python)
+        self.second.tags.add(self.django)
+        self.assertEqual(self.counts(), {'django': 2, 'python': 1})
+        self.django.posts.remove(self.first)
+        self.assertEqual(self.counts(), {'django': 1, 'python': 1})
+        self.first.tags.clear()
+        self.assertEqual(self.counts(), {'django': 1, 'python': 0})
+        self.second.delete()
+        self.assertEqual(self.counts(), {'django': 0, 'python': 0})
+
+    def test_reconcile_fixes_drift_and_invalidates_pages(self):
+        self.first.tags.add(self.django)
+        an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        Tag.objects.filter(pk=self.django.pk).update(post_count=5, updated_at=an_hour_ago)
+        urls = [reverse('tags_list_url'), self.django.get_absolute_url()]
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        call_command('reconcile_tag_counts', stdout=io.StringIO())
+        self.assertEqual(self.counts(), {'django': 1, 'python': 0})
+        self.assertGreater(Tag.objects.get(pk=self.django.pk).updated_at, an_hour_ago)
+        for url, etag in etags.items():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertContains(response, '1 post', msg_prefix=url)
+            self.assertNotContains(response, '5 posts', msg_prefix=url)
+
+
+class PopularityTests(BlogTestCase):
+
+    def setUp(self):
+        self.tag = Tag.objects.create(title='popular')
+        now = timezone.now()
+        self.posts = {}
+        for age in (1, 10, 40):
+            post = Post.objects.create(title='{} days old'.format(age))
+            Post.objects.filter(pk=post.pk).update(date_pub=now - datetime.timedelta(days=age))
+            self.posts[age] = Post.objects.get(pk=post.pk)
+
+    def counts(self):
+        return tuple(Tag.objects.filter(pk=self.tag.pk).values_list('posts_7d', 'posts_30d')[0])
+
+    def test_windows_follow_links(self):
+        self.posts[1].tags.add(self.tag)
+        self.tag.posts.add(self.posts[10], self.posts[40])
+        self.assertEqual(self.counts(), (1, 2))
+        self.posts[10].tags.remove(self.tag)
+        self.assertEqual(self.counts(), (1, 1))
+        self.posts[40].tags.clear()
+        self.assertEqual(self.counts(), (1, 1))
+        self.posts[1].delete()
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_refresh_ages_posts_out_and_invalidates_pages(self):
+        self.tag.posts.add(*self.posts.values())
+        self.assertEqual(self.counts(), (1, 2))
+        # Weeks later nothing has touched the counters.
+        Post.objects.update(date_pub=F('date_pub') - datetime.timedelta(days=25))
+        an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        Tag.objects.update(updated_at=an_hour_ago)
+        url = reverse('tags_list_url')
+        etag = self.client.get(url)['ETag']
+        out = io.StringIO()
+        call_command('refresh_tag_popularity', stdout=out)
+        self.assertIn('Refreshed 1 tag(s)', out.getvalue())
+        self.assertEqual(self.counts(), (0, 1))
+        self.assertGreater(Tag.objects.get(pk=self.tag.pk).updated_at, an_hour_ago)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, '0 this week, 1 this month')
+        call_command('refresh_tag_popularity', stdout=out)
+        self.assertIn('Refreshed 0 tag(s)', out.getvalue())
+
+
+class ExcerptTests(BlogTestCase):
+
+    def test_save_fills_the_excerpt(self):
+        post = Post.objects.create(title='long', body=' '.join('word{}'.format(i) for i in range(40)))
+        self.assertTrue(post.excerpt.startswith('word0 word1 '))
+        self.assertIn('word14', post.excerpt)
+        self.assertNotIn('word15', post.excerpt)
+        post.body = 'short body'
+        post.save()
+        self.assertEqual(Post.objects.get(pk=post.pk).excerpt, 'short body')
+
+    def test_backfill_fills_empty_excerpts_and_invalidates_pages(self):
+        post = Post.objects.create(title='backfilled', body='the backfilled excerpt')
+        Post.objects.filter(pk=post.pk).update(excerpt='')
+        cache.clear()
+        urls = [reverse('posts_list_url'), post.get_absolute_url()]
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        self.assertNotContains(self.client.get(urls[0]), 'the backfilled excerpt')
+        out = io.StringIO()
+        call_command('backfill_excerpts', stdout=out)
+        self.assertIn('Updated 1 excerpt(s)', out.getvalue())
+        self.assertEqual(Post.objects.get(pk=post.pk).excerpt, 'the backfilled excerpt')
+        for url, etag in etags.items():
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, url)
+        self.assertContains(self.client.get(urls[0]), 'the backfilled excerpt')
+
+
+class CursorPaginatorTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(7):
+            Post.objects.create(title='post {}'.format(i))
+        # Ties on date_pub are settled by pk.
+        moment = timezone.now()
+        Post.objects.filter(title__in=['post 1', 'post 2', 'post 3', 'post 4']).update(date_pub=moment)
+        cls.ordered = list(Post.objects.order_by('-date_pub', '-pk'))
+
+    def paginator(self):
+        return CursorPaginator(Post.objects.all(), 3)
+
+    def walk(self):
+        pages = [self.paginator().page()]
+        while pages[-1].has_next():
+            pages.append(self.paginator().page(pages[-1].next_cursor))
+        return pages
+
+    def test_next_cursors_walk_every_row_once(self):
+        pages = self.walk()
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([post for page in pages for post in page], self.ordered)
+        self.assertFalse(pages[0].has_previous())
+
+    def test_previous_cursors_walk_back(self):
+        pages = self.walk()
+        back = [pages[-1]]
+        while back[-1].has_previous():
+            back.append(self.paginator().page(back[-1].previous_cursor))
+        self.assertEqual([list(page) for page in back], [list(page) for page in reversed(pages)])
+        self.assertTrue(back[-1].has_next())
+
+    def test_malformed_cursor_gives_first_page(self):
+        def cursor(data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+        paginator = self.paginator()
+        first = list(paginator.page())
+        for bad in ['!!', cursor('n'), cursor(['x', ['2019-01-01T00:00:00', 1]]), cursor(['n', [1]]),
+                    cursor(['n', ['yesterday', 1]]), cursor(['p', ['2019-01-01T00:00:00', 'one']])]:
+            self.assertEqual(list(paginator.page(bad)), first, bad)
+
+
+class PageCacheTests(BlogTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.django, self.python = Tag.objects.create(title='django'), Tag.objects.create(title='python')
+        self.orm = Post.objects.create(title='orm tips')
+        self.orm.tags.add(self.django)
+        self.typing = Post.objects.create(title='typing tips')
+        self.typing.tags.add(self.python)
+
+    def urls(self):
+        return {
+            'posts': reverse('posts_list_url'), 'tags': reverse('tags_list_url'),
+            'orm': self.orm.get_absolute_url(), 'typing': self.typing.get_absolute_url(),
+            'django': self.django.get_absolute_url(), 'python': self.python.get_absolute_url(),
+        }
+
+    def cached(self):
+        """Names of the pages served without running their view."""
+        served = set()
+        for name, url in self.urls().items():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            if not queries:
+                served.add(name)
+        return served
+
+    def test_anonymous_pages_come_from_cache(self):
+        self.assertEqual(self.cached(), set())
+        self.assertEqual(self.cached(), set(self.urls()))
+
+    def test_edits_invalidate_only_dependent_pages(self):
+        self.cached()
+        self.orm.title = 'orm recipes'
+        self.orm.save()
+        self.assertEqual(set(self.urls()) - self.cached(), {'posts', 'orm', 'django'})
+        self.python.title = 'snake'
+        self.python.save()
+        self.assertEqual(set(self.urls()) - self.cached(), {'posts', 'tags', 'typing', 'python'})
+
+    def test_session_cookie_bypasses_the_cache(self):
+        self.cached()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anything'
+        self.assertEqual(self.cached(), set())
+
+
+class SearchBackendTests:
+    """Run against each backend through the ``backend`` of the subclasses."""
+    backend = None
+
+    def setUp(self):
+        previous = search._backend
+        search._backend = self.backend()
+        self.addCleanup(setattr, search, '_backend', previous)
+        self.python = Tag.objects.create(title='python')
+        self.tips = Post.objects.create(title='Django tips', body='orm queries')
+        self.tips.tags.add(self.python)
+        self.notes = Post.objects.create(title='Weekly notes', body='a django aside')
+        self.diary = Post.objects.create(title='Djangonaut diary', body='flask')
+        # Built before the edits, so they have to go through the signals.
+        self.ids('warm up')
+
+    def ids(self, query):
+        return [post.pk for post in search.search_posts(query)[:20]]
+
+    def test_matches_whole_tokens_and_prefixes(self):
+        self.assertCountEqual(self.ids('django'), [self.tips.pk, self.notes.pk, self.diary.pk])
+        self.assertCountEqual(self.ids('DJAN'), [self.tips.pk, self.notes.pk, self.diary.pk])
+        self.assertEqual(self.ids('tip'), [self.tips.pk])
+        self.assertEqual(self.ids('ips'), [])
+
+    def test_requires_every_token(self):
+        self.assertEqual(self.ids('django orm'), [self.tips.pk])
+        self.assertEqual(self.ids('djan flask'), [self.diary.pk])
+        self.assertEqual(self.ids('django missing'), [])
+
+    def test_ranks_title_matches_over_body_matches(self):
+        self.assertEqual(self.ids('django')[-1], self.notes.pk)
+        self.assertEqual(self.ids('notes aside'), [self.notes.pk])
+
+    def test_follows_post_saves_and_deletes(self):
+        self.notes.body = 'nothing to see'
+        self.notes.save()
+        added = Post.objects.create(title='Aside')
+        self.assertEqual(self.ids('aside'), [added.pk])
+        self.assertEqual(self.ids('nothing'), [self.notes.pk])
+        self.tips.delete()
+        self.assertEqual(self.ids('tips'), [])
+
+    def test_follows_tag_renames_and_deletes(self):
+        self.python.title = 'snake'
+        self.python.save()
+        self.assertEqual(self.ids('python'), [])
+        self.assertEqual(self.ids('snake'), [self.tips.pk])
+        self.python.delete()
+        self.assertEqual(self.ids('snake'), [])
+
+
+class Fts5SearchTests(SearchBackendTests, BlogTestCase):
+    backend = search.Fts5Backend
+
+
+class MemorySearchTests(SearchBackendTests, BlogTestCase):
+    backend = search.MemoryBackend
+
+    def test_ranks_whole_tokens_over_prefixes(self):
+        self.assertEqual(self.ids('django')[0], self.tips.pk)
+
+    @override_settings(BLOG_SEARCH_RECHECK=0)
+    def test_other_processes_follow_changes(self):
+        other = search.MemoryBackend()
+        other.rebuild()
+        self.notes.body = 'nothing to see'
+        self.notes.save()
+        self.tips.delete()
+        self.assertEqual(other.ranked_ids(['nothing']), [self.notes.pk])
+        self.assertEqual(other.ranked_ids(['tips']), [])
+
+
+@override_settings(BLOG_CARD_STATS_FLUSH=3600)
+class CardStatsTests(BlogTestCase):
+
+    def setUp(self):
+        cache.clear()
+        fragments.reset_stats()
+
+    def test_renders_count_in_process_until_flushed(self):
+        posts = [Post.objects.create(title='post {}'.format(i)) for i in range(3)]
+        fragments.render_cards(posts)
+        fragments.render_cards(posts[:2])
+        self.assertEqual(cache.get_many(list(fragments.STATS_KEYS.values())), {})
+        self.assertEqual(fragments.stats(), {'hits': 2, 'misses': 3})
+        fragments.render_cards(posts[:1])
+        self.assertEqual(fragments.stats(), {'hits': 3, 'misses': 3})
+
+
+@override_settings(BLOG_POSTS_PER_PAGE=2, BLOG_SEARCH_COUNT_LIMIT=5)
+class SearchPaginatorTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(10):
+            Post.objects.create(title='capped {}'.format(i))
+
+    def setUp(self):
+        cache.clear()
+
+    def page(self, number):
+        response = self.client.get(reverse('posts_list_url'), {'search': 'capped', 'page': number})
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_object']
+
+    def test_pages_stop_at_the_count_limit(self):
+        page = self.page(3)
+        self.assertTrue(page.paginator.estimated)
+        self.assertEqual((page.number, len(page.object_list), page.has_next()), (3, 1, False))
+
+    def test_page_past_the_limit_shows_the_last_page(self):
+        # Page 4 still finds rows past the cap, page 6 none at all.
+        for number in (4, 6, 336):
+            self.assertEqual(self.page(number).number, 3)
+
+
+class RefusingEmailBackend(BaseEmailBackend):
+
+    def open(self):
+        raise ConnectionRefusedError(111, 'Connection refused')
+
+
+class RejectingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, messages):
+        raise OSError('550 rejected')
+
+
+@override_settings(BLOG_OUTBOX_MAX_ATTEMPTS=2)
+class OutboxTests(BlogTestCase):
+
+    def setUp(self):
+        self.emails = [outbox.enqueue('subject', 'body', ['reader@example.com']) for i in range(2)]
+
+    def states(self):
+        return list(QueuedEmail.objects.order_by('pk').values_list('status', 'attempts'))
+
+    def make_due(self):
+        QueuedEmail.objects.update(send_after=timezone.now())
+
+    def test_send(self):
+        self.assertEqual(outbox.send_queued(), (2, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(self.states(), [(QueuedEmail.SENT, 1)] * 2)
+
+    @override_settings(EMAIL_BACKEND='blog.tests.RejectingEmailBackend')
+    def test_failures_back_off_then_give_up(self):
+        self.assertEqual(outbox.send_queued(), (0, 2))
+        self.assertEqual(self.states(), [(QueuedEmail.PENDING, 1)] * 2)
+        # Not due again until the backoff has passed.
+        self.assertEqual(outbox.send_queued(), (0, 0))
+        self.make_due()
+        self.assertEqual(outbox.send_queued(), (0, 2))
+        self.assertEqual(self.states(), [(QueuedEmail.FAILED, 2)] * 2)
+
+    @override_settings(EMAIL_BACKEND='blog.tests.RefusingEmailBackend')
+    def test_unreachable_server_counts_as_attempt(self):
+        self.assertEqual(outbox.send_queued(), (0, 2))
+        self.assertEqual(self.states(), [(QueuedEmail.PENDING, 1)] * 2)
+        self.assertIn('Connection refused', QueuedEmail.objects.first().last_error)
+
+
+class AvatarTests(BlogTestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_root = self.settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def test_upload_metadata_is_not_kept(self):
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera maker'
+        upload = io.BytesIO()
+        Image.new('RGB', (500, 300), 'red').save(upload, 'JPEG', exif=exif)
+        name = default_storage.save('profiles/upload.jpg', ContentFile(upload.getvalue()))
+        profile = User.objects.create_user('pictured').profile
+        Profile.objects.filter(pk=profile.pk).update(avatar=name)
+
+        avatars.process(Profile.objects.get(pk=profile.pk))
+        profile = Profile.objects.get(pk=profile.pk)
+        self.assertEqual(profile.avatar.name, avatars.full_name(profile.avatar_hash))
+        self.assertFalse(default_storage.exists(name))
+        for stored in [profile.avatar.name] + [avatars.variant_name(profile.avatar_hash, size, 'jpg')
+                                               for size in settings.BLOG_AVATAR_SIZES]:
+            with default_storage.open(stored) as image:
+                self.assertFalse(Image.open(image).getexif(), stored)
+
+    def test_full_variant_keeps_the_upload_size(self):
+        upload = io.BytesIO()
+        Image.new('RGB', (3300, 2500), 'blue').save(upload, 'JPEG')
+        name = default_storage.save('profiles/large.jpg', ContentFile(upload.getvalue()))
+        profile = User.objects.create_user('large').profile
+        Profile.objects.filter(pk=profile.pk).update(avatar=name)
+
+        avatars.process(Profile.objects.get(pk=profile.pk))
+        profile = Profile.objects.get(pk=profile.pk)
+        with default_storage.open(profile.avatar.name) as image:
+            self.assertEqual(Image.open(image).size, (3300, 2500))
+        largest = max(settings.BLOG_AVATAR_SIZES)
+        with default_storage.open(avatars.variant_name(profile.avatar_hash, largest, 'jpg')) as image:
+            self.assertEqual(Image.open(image).size, (largest, largest))
+
+
+class StaticFilesTests(BlogTestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.files = {
+            'app.0123456789ab.css': b'body {}',
+            'app.0123456789ab.css.br': b'brotli',
+            'app.0123456789ab.css.gz': b'gzip',
+            'notes.txt': b'plain',
+            'notes.txt.br': b'brotli',
+            'avatars/ab/abcd/64.jpg': b'jpeg',
+        }
+        for name, content in self.files.items():
+            os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+            with open(os.path.join(root, name), 'wb') as file:
+                file.write(content)
+        self.application = static_wsgi.StaticFilesApplication(None, [
+            static_wsgi.Mount('/static/', root, static_wsgi.hashed_name),
+            static_wsgi.Mount('/media/', root, static_wsgi.content_addressed),
+        ])
+
+    def get(self, path, **environ):
+        started = {}
+
+        def start_response(status, headers):
+            started['status'], started['headers'] = status, dict(headers)
+
+        body = b''.join(self.application(dict(environ, REQUEST_METHOD='GET', PATH_INFO=path),
+                                         start_response))
+        return started['status'], started['headers'], body
+
+    def test_picks_the_accepted_encoding(self):
+        css = '/static/app.0123456789ab.css'
+        for accepted, encoding, body in [('gzip, br', 'br', b'brotli'), ('gzip;q=1', 'gzip', b'gzip'),
+                                         ('', None, b'body {}')]:
+            status, headers, content = self.get(css, HTTP_ACCEPT_ENCODING=accepted)
+            self.assertEqual((status, headers.get('Content-Encoding'), content),
+                             ('200 OK', encoding, body), accepted)
+            self.assertEqual(headers['Vary'], 'Accept-Encoding')
+
+    def test_vary_with_only_a_brotli_sibling(self):
+        status, headers, content = self.get('/static/notes.txt', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(content, b'plain')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        status, headers, content = self.get('/media/avatars/ab/abcd/64.jpg')
+        self.assertNotIn('Vary', headers)
+
+    def test_validators_give_304(self):
+        status, headers, content = self.get('/static/notes.txt')
+        for environ in [{'HTTP_IF_NONE_MATCH': headers['ETag']},
+                        {'HTTP_IF_MODIFIED_SINCE': headers['Last-Modified']}]:
+            status, _, content = self.get('/static/notes.txt', **environ)
+            self.assertEqual((status, content), ('304 Not Modified', b''), environ)
+
+    def test_only_unchanging_names_are_immutable(self):
+        cache_controls = {path: self.get(path)[1]['Cache-Control'] for path in [
+            '/static/app.0123456789ab.css', '/static/notes.txt', '/media/avatars/ab/abcd/64.jpg']}
+        self.assertEqual(cache_controls, {
+            '/static/app.0123456789ab.css': static_wsgi.IMMUTABLE,
+            '/static/notes.txt': static_wsgi.REVALIDATE,
+            '/media/avatars/ab/abcd/64.jpg': static_wsgi.IMMUTABLE,
+        })
+        self.assertEqual(self.get('/static/../etc/passwd')[0], '404 Not Found')
+
+
+class SlugTests(BlogTestCase):
+
+    def test_same_title_gets_counted_suffixes(self):
+        slugs = [Post.objects.create(title='Same title').slug for i in range(3)]
+        self.assertEqual(slugs, ['same-title', 'same-title-2', 'same-title-3'])
+
+    def test_base_ending_in_digits_never_clashes(self):
+        tens = [Post.objects.create(title='Top').slug for i in range(10)]
+        self.assertEqual(tens[-1], 'top-10')
+        self.assertEqual(Post.objects.create(title='Top 10').slug, 'top-10-1')
+        self.assertEqual(Post.objects.create(title='Top').slug, 'top-11')
+
+    def test_counter_moves_past_hand_edited_slug(self):
+        Post.objects.create(title='Edited')
+        post = Post.objects.create(title='Other')
+        post.slug = 'edited-7'
+        post.save()
+        self.assertEqual(Post.objects.create(title='Edited').slug, 'edited-8')
+
+    def test_new_base_is_seeded_from_existing_rows(self):
+        # Rows written before the counters existed, one with a legacy
+        # timestamp suffix.
+        Post.objects.bulk_create([Post(title='Old', slug='old'), Post(title='Old', slug='old-4'),
+                                  Post(title='Old', slug='old-1558453440')])
+        self.assertEqual(Post.objects.create(title='Old').slug, 'old-5')
+
+    def test_bulk_assignment(self):
+        Tag.objects.create(title='Bulk')
+        tags = assign_slugs([Tag(title='Bulk') for i in range(3)]
+                            + [Tag(title='Picked', slug='Picked')])
+        self.assertEqual([tag.slug for tag in tags], ['bulk-2', 'bulk-3', 'bulk-4', 'picked'])
+        self.assertEqual(SlugSequence.objects.get(base='bulk').last_value, 4)
+
+    def test_hand_written_slugs_are_stored_lower_case(self):
+        post = Post.objects.create(title='Post')
+        post.slug = 'Mixed-Case'
+        post.save()
+        self.assertTrue(Post.objects.filter(pk=post.pk, slug='mixed-case').exists())
+        form = TagForm({'title': 'Tag', 'slug': 'Also-Mixed'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['slug'], 'also-mixed')
+        self.assertFalse(TagForm({'title': 'Tag', 'slug': 'CREATE'}).is_valid())
+
+    def test_mixed_case_urls_redirect_permanently(self):
+        post = Post.objects.create(title='Legacy post')
+        tag = Tag.objects.create(title='Legacy tag')
+        response = self.client.get(reverse('post_detail_url', kwargs={'slug': 'Legacy-Post'}))
+        self.assertRedirects(response, post.get_absolute_url(), status_code=301)
+        response = self.client.get(reverse('tag_detail_url', kwargs={'slug': 'LEGACY-TAG'}) + '?page=2')
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], tag.get_absolute_url() + '?page=2')
+
+    def test_lower_case_urls_are_not_redirected(self):
+        post = Post.objects.create(title='Current post')
+        self.assertEqual(self.client.get(post.get_absolute_url()).status_code, 200)
+        response = self.client.get(reverse('post_detail_url', kwargs={'slug': 'Missing'}), follow=True)
+        self.assertEqual(response.redirect_chain[0][1], 301)
+        self.assertEqual(response.status_code, 404)
+
+
+class TransferTests(BlogTestCase):
+
+    def import_records(self, *records):
+        return transfer.import_posts(json.dumps(record) + '\n' for record in records)
+
+    def slugs(self, title):
+        return list(Post.objects.filter(title=title).order_by('pk').values_list('slug', flat=True))
+
+    def test_requested_and_generated_slugs_in_one_batch(self):
+        self.import_records({'title': 'Foo', 'slug': 'foo'}, {'title': 'Foo'},
+                            {'title': 'Bar', 'slug': 'bar-2'}, {'title': 'Bar'}, {'title': 'Bar'})
+        self.assertEqual(self.slugs('Foo'), ['foo', 'foo-2'])
+        self.assertEqual(self.slugs('Bar'), ['bar-2', 'bar-3', 'bar-4'])
+
+    def test_taken_slug_is_replaced(self):
+        Post.objects.create(title='Taken')
+        self.assertEqual(self.import_records({'title': 'Taken', 'slug': 'taken', 'tags': ['a']}),
+                         (1, 1))
+        self.assertEqual(self.slugs('Taken'), ['taken', 'taken-2'])
+
+    def test_round_trip(self):
+        self.import_records({'title': 'Trip', 'body': 'body', 'tags': ['x', 'y'],
+                             'date_pub': '2019-05-21T16:34:00+00:00'})
+        exported = json.loads(next(transfer.export_posts()))
+        self.assertEqual((exported['slug'], exported['tags'], exported['date_pub']),
+                         ('trip', ['x', 'y'], '2019-05-21T16:34:00+00:00'))
+        self.assertEqual(Tag.objects.get(title='x').post_count, 1)
+
+
+class FeedTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(title='feeds')
+        Post.objects.create(title='post', body='feed body').tags.add(cls.tag)
+
+    def test_repeated_poll_needs_no_queries(self):
+        cache.clear()
+        for url in (reverse('posts_atom_url'), reverse('tag_rss_url', kwargs={'slug': 'feeds'})):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_new_post_changes_etag(self):
+        url = reverse('posts_rss_url')
+        etag = self.client.get(url)['ETag']
+        Post.objects.create(title='another')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'another')
+
+
+@override_settings(BLOG_SITEMAP_SHARD_SIZE=3)
+class SitemapTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.posts = [Post.objects.create(title='post {}'.format(i)) for i in range(7)]
+
+    def shard_url(self, shard):
+        return reverse('sitemap_shard_url', kwargs={'section': 'posts', 'shard': shard})
+
+    def test_index_lists_shards(self):
+        response = self.client.get(reverse('sitemap_index_url'))
+        for shard in range(3):
+            self.assertContains(response, self.shard_url(shard))
+
+    def test_change_regenerates_only_its_shard(self):
+        cache.clear()
+        etags = [self.client.get(self.shard_url(shard))['ETag'] for shard in range(3)]
+        post = self.posts[4]
+        post.title = 'renamed'
+        post.save()
+        statuses = [self.client.get(self.shard_url(shard), HTTP_IF_NONE_MATCH=etag).status_code
+                    for shard, etag in enumerate(etags)]
+        self.assertEqual(statuses, [304, 200, 304])
+
+    def test_unknown_shard_is_404_without_cache_entries(self):
+        cache.clear()
+        for url in [self.shard_url(3), self.shard_url(10 ** 6),
+                    reverse('sitemap_shard_url', kwargs={'section': 'nothing', 'shard': 0})]:
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+        keys = [pagecache._generation_key(sitemaps._dependency('posts', shard)) for shard in (3, 10 ** 6)]
+        self.assertEqual(cache.get_many(keys), {})
+
+
+@override_settings(BLOG_RELATED_POSTS=2)
+class RelatedPostTests(BlogTestCase):
+
+    def setUp(self):
+        self.common, self.rare = Tag.objects.create(title='common'), Tag.objects.create(title='rare')
+        self.posts = [Post.objects.create(title='post {}'.format(i)) for i in range(5)]
+        for post in self.posts:
+            post.tags.add(self.common)
+        self.posts[0].tags.add(self.rare)
+
+    def process(self):
+        while related.process_queue()[0]:
+            pass
+
+    def related(self, post):
+        return list(post.related_posts.order_by('-score', '-related_id')
+                    .values_list('related_id', flat=True))
+
+    def test_tagging_updates_neighbours(self):
+        first, second = self.posts[:2]
+        self.process()
+        self.assertNotIn(second.pk, self.related(first))
+        with CaptureQueriesContext(connection) as queries:
+            second.tags.add(self.rare)
+        # The request only queues the post, the worker does the rest.
+        self.assertEqual(len([query for query in queries if 'related' in query['sql']]), 2)
+        self.assertNotIn(second.pk, self.related(first))
+        self.process()
+        self.assertEqual(self.related(first)[0], second.pk)
+        self.assertEqual(self.related(second)[0], first.pk)
+        self.assertEqual(related.rebuild(), [])
+
+    def test_tag_deletion_updates_neighbours(self):
+        self.posts[1].tags.add(self.rare)
+        self.rare.delete()
+        self.process()
+        self.assertEqual(related.rebuild(), [])
+
+    def test_post_deletion_refills_lists(self):
+        self.process()
+        first = self.posts[0]
+        removed = Post.objects.get(pk=self.related(first)[0])
+        removed.delete()
+        self.process()
+        self.assertEqual(len(self.related(first)), 2)
+        self.assertEqual(related.rebuild(), [])
+
+    def test_post_detail_lists_related_posts(self):
+        first, second = self.posts[:2]
+        second.tags.add(self.rare)
+        self.process()
+        response = self.client.get(first.get_absolute_url())
+        self.assertEqual([post.pk for post in response.context['related_posts']],
+                         self.related(first))
+        etag = response['ETag']
+        second.title = 'renamed'
+        second.save()
+        response = self.client.get(first.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'renamed')
+
+
+class AutocompleteTests(BlogTestCase):
+
+    def setUp(self):
+        self.tag = Tag.objects.create(title='Django')
+        self.post = Post.objects.create(title='Tuning the Django ORM')
+        autocomplete.index.rebuild()
+
+    def suggest(self, query, **params):
+        response = self.client.get(reverse('autocomplete_url'), dict(q=query, **params))
+        return [(result['type'], result['title']) for result in response.json()['results']]
+
+    def test_matches_word_prefixes_without_queries(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('djan'), [('tag', 'Django'), ('post', 'Tuning the Django ORM')])
+            self.assertEqual(self.suggest('django o', type='post'), [('post', 'Tuning the Django ORM')])
+            self.assertEqual(self.suggest('orms'), [])
+
+    def test_follows_saves_and_deletes(self):
+        self.post.title = 'Tuning Postgres'
+        self.post.save()
+        self.tag.delete()
+        self.assertEqual(self.suggest('django'), [])
+        self.assertEqual(self.suggest('postg'), [('post', 'Tuning Postgres')])
+
+    def test_unknown_type_is_rejected(self):
+        response = self.client.get(reverse('autocomplete_url'), {'q': 'dj', 'type': 'user'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(BLOG_AUTOCOMPLETE_RECHECK=0)
+    def test_other_processes_replay_changes_without_queries(self):
+        other = autocomplete.PrefixIndex()
+        other.rebuild()
+        self.post.title = 'Tuning Postgres'
+        self.post.save()
+        self.tag.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(other.lookup('django'), [])
+            self.assertEqual([result['title'] for result in other.lookup('postg')], ['Tuning Postgres'])
+
+    @override_settings(BLOG_AUTOCOMPLETE_RECHECK=0)
+    def test_lost_deltas_reload_in_the_background(self):
+        other = autocomplete.PrefixIndex()
+        other.rebuild()
+        # Drops the deltas of the setUp rows, which ``other`` has seen.
+        cache.clear()
+        with mock.patch.object(other, '_rebuild_in_background') as rebuild:
+            self.assertEqual(len(other.lookup('tuning')), 1)
+        rebuild.assert_called_once_with()
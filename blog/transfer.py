@@ -0,0 +1,150 @@
+"""
+JSON lines import and export of posts.
+
+One post per line::
+
+    {"title": "...", "slug": "...", "body": "...", "date_pub": "2019-05-21T16:34:00+00:00",
+     "tags": ["django", "python"]}
+
+Only ``title`` is required on import.  Both directions stream: the export
+walks the table with ``iterator()`` and loads tags per chunk, the import
+reads, creates and commits one batch of posts at a time, resolving tag
+titles through an in-memory map.
+"""
+import json
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from . import autocomplete, pagecache, popularity, search, signals
+from .models import Post, Tag, assign_slugs, claim_slug, make_excerpt, normalize_slug
+from .utils import chunks
+
+
+EXPORT_FIELDS = ('pk', 'title', 'slug', 'body', 'date_pub')
+
+
+class TransferError(ValueError):
+    pass
+
+
+def export_posts(queryset=None, chunk_size=1000):
+    """Yield one JSON line per post in ``queryset``, oldest first."""
+    if queryset is None:
+        queryset = Post.objects.all()
+    tag_titles = dict(Tag.objects.values_list('pk', 'title'))
+    rows = (queryset.prefetch_related(None).order_by('pk').values_list(*EXPORT_FIELDS)
+            .iterator(chunk_size=chunk_size))
+    for chunk in chunks(rows, chunk_size):
+        tags = defaultdict(list)
+        links = (Post.tags.through.objects.filter(post_id__in=[row[0] for row in chunk])
+                 .order_by('id').values_list('post_id', 'tag_id'))
+        for post_id, tag_id in links:
+            tags[post_id].append(tag_titles[tag_id])
+        for pk, title, slug, body, date_pub in chunk:
+            yield json.dumps({
+                'title': title,
+                'slug': slug,
+                'body': body,
+                'date_pub': date_pub.isoformat(),
+                'tags': tags[pk],
+            }, ensure_ascii=False) + '\n'
+
+
+def _parse(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise TransferError('line {}: {}'.format(number, error))
+        if not isinstance(record, dict) or not record.get('title'):
+            raise TransferError('line {}: a post needs a title'.format(number))
+        date_pub = record.get('date_pub')
+        if date_pub and parse_datetime(date_pub) is None:
+            raise TransferError('line {}: bad date_pub "{}"'.format(number, date_pub))
+        yield record
+
+
+class TagMap:
+    """Tag ids by title, creating missing tags in bulk."""
+
+    def __init__(self):
+        self.ids = dict(Tag.objects.values_list('title', 'pk'))
+        self.created = 0
+
+    def add_missing(self, titles):
+        missing = sorted({title for title in titles if title not in self.ids})
+        if missing:
+            Tag.objects.bulk_create(assign_slugs([Tag(title=title) for title in missing]))
+            rows = list(Tag.objects.filter(title__in=missing).values_list('pk', 'title', 'slug'))
+            created = {title: pk for pk, title, slug in rows}
+            self.ids.update(created)
+            self.created += len(created)
+            autocomplete.index.put('tag', rows)
+            signals.bump_pages(tag_ids=created.values(), collections=[pagecache.TAG_LIST])
+
+
+def _import_batch(records, tag_map):
+    posts = []
+    for record in records:
+        body = record.get('body') or ''
+        posts.append(Post(title=record['title'], body=body, excerpt=make_excerpt(body),
+                          slug=normalize_slug(record.get('slug') or '')))
+
+    # Requested slugs that are taken, also within the batch, get a new one.
+    requested = [post.slug for post in posts if post.slug]
+    taken = set(Post.objects.filter(slug__in=requested).values_list('slug', flat=True))
+    for post in posts:
+        if post.slug in taken:
+            post.slug = ''
+        elif post.slug:
+            taken.add(post.slug)
+            claim_slug(Post, post.slug)
+    assign_slugs(posts)
+    Post.objects.bulk_create(posts)
+
+    # bulk_create does not return primary keys on every backend.
+    tag_titles = [list(dict.fromkeys(record.get('tags') or [])) for record in records]
+    tag_map.add_missing(title for titles in tag_titles for title in titles)
+    ids = dict(Post.objects.filter(slug__in=[post.slug for post in posts]).values_list('slug', 'pk'))
+    dated = []
+    links = []
+    for post, record, titles in zip(posts, records, tag_titles):
+        post.pk = ids[post.slug]
+        if record.get('date_pub'):
+            post.date_pub = post.updated_at = parse_datetime(record['date_pub'])
+            dated.append(post)
+        links += [(post.pk, tag_map.ids[title]) for title in titles]
+    if dated:
+        # date_pub is auto_now_add, so it can only be set afterwards.
+        Post.objects.bulk_update(dated, ['date_pub', 'updated_at'])
+    Post.tags.through.objects.bulk_create(
+        [Post.tags.through(post_id=post_id, tag_id=tag_id) for post_id, tag_id in links])
+
+    # What the signals would have done post by post.
+    tag_ids = [tag_id for post_id, tag_id in links]
+    signals.shift_post_counts(tag_ids, 1)
+    popularity.shift_recent_counts(links, 1, {post.pk: post.date_pub for post in posts})
+    signals.touch(tag_ids=set(tag_ids))
+    post_ids = [post.pk for post in posts]
+    search.index_posts(post_ids)
+    autocomplete.put_posts(posts)
+    signals.bump_pages(post_ids, set(tag_ids), [pagecache.POST_LIST, pagecache.TAG_LIST])
+    return len(posts)
+
+
+def import_posts(lines, batch_size=1000):
+    """
+    Create posts from JSON ``lines``, committing every ``batch_size``
+    posts.  Returns ``(posts, tags)`` created; a malformed line raises
+    ``TransferError`` and leaves the batches before it in place.
+    """
+    tag_map = TagMap()
+    created = 0
+    for records in chunks(_parse(lines), batch_size):
+        with transaction.atomic():
+            created += _import_batch(records, tag_map)
+    return created, tag_map.created
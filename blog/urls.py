@@ -1,6 +1,7 @@
 from django.urls import path
 
 from .views import *
+from . import api, autocomplete, feeds
 
 
 urlpatterns = [
@@ -9,14 +10,25 @@ urlpatterns = [
         path('post/<str:slug>/', PostDetail.as_view(), name='post_detail_url'),
         path('post/<str:slug>/update/', PostUpdate.as_view(), name='post_update_url'),
         path('post/<str:slug>/delete/', PostDelete.as_view(), name='post_delete_url'),
+        path('feed/rss/', feeds.latest_rss, name='posts_rss_url'),
+        path('feed/atom/', feeds.latest_atom, name='posts_atom_url'),
         path('tags/', tags_list, name='tags_list_url'),
         path('tag/create/', TagCreate.as_view(), name='tag_create_url'),
         path('tag/<str:slug>/', TagDetail.as_view(), name='tag_detail_url'),
+        path('tag/<str:slug>/feed/rss/', feeds.tag_rss, name='tag_rss_url'),
+        path('tag/<str:slug>/feed/atom/', feeds.tag_atom, name='tag_atom_url'),
         path('tag/<str:slug>/update/', TagUpdate.as_view(), name='tag_update_url'),
         path('tag/<str:slug>/delete/', TagDelete.as_view(), name='tag_delete_url'),
         path('profile/<int:pk>/', UserProfileDetail.as_view(), name='user_profile_url'),
         path('profile/<int:pk>/edit/', UserProfileUpdate.as_view(), name='user_profile_edit_url'),
-        path('profiles/', profiles_list, name='profiles_list_url')
+        path('profiles/', profiles_list, name='profiles_list_url'),
+        path('api/posts/', api.posts, name='api_posts_url'),
+        path('api/posts/<str:slug>/', api.post_detail, name='api_post_detail_url'),
+        path('api/tags/', api.tags, name='api_tags_url'),
+        path('api/tags/<str:slug>/', api.tag_detail, name='api_tag_detail_url'),
+        path('api/profiles/', api.profiles, name='api_profiles_url'),
+        path('api/profiles/<int:pk>/', api.profile_detail, name='api_profile_detail_url'),
+        path('autocomplete/', autocomplete.suggest, name='autocomplete_url'),
 
 
 
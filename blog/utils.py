@@ -1,22 +1,67 @@
+import time
+from itertools import islice
+
 from django.shortcuts import render
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
 from django.urls import reverse
+from django.db.models import Q
+
+from .models import Post, Tag, normalize_slug
+from .pagecache import depend_on, instance_dependency
+
+
+# Stands in for the slug or id when reversing a url to fill in later.
+PLACEHOLDER = '987654321'
+
 
-from .models import Post, Tag
+def prefix_filter(field, prefix):
+    """
+    ``Q`` for values of ``field`` starting with ``prefix``, written as a
+    range so a plain index on the column can serve it (``startswith``
+    becomes a LIKE that SQLite cannot match against the index).
+    """
+    condition = Q(**{field + '__gte': prefix})
+    if ord(prefix[-1]) < 0x10ffff:
+        condition &= Q(**{field + '__lt': prefix[:-1] + chr(ord(prefix[-1]) + 1)})
+    return condition
 
 
-class ObjectDetailMixin:
+class SlugLookupMixin:
+    """
+    Look objects up by exact, indexed slug equality.  Legacy mixed-case
+    URLs are redirected permanently to their lower-case form.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        slug = kwargs.get('slug')
+        if (slug is not None and slug != normalize_slug(slug)
+                and request.method in ('GET', 'HEAD')):
+            kwargs['slug'] = normalize_slug(slug)
+            url = reverse(request.resolver_match.view_name, kwargs=kwargs)
+            if request.META.get('QUERY_STRING'):
+                url += '?' + request.META['QUERY_STRING']
+            return redirect(url, permanent=True)
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ObjectDetailMixin(SlugLookupMixin):
     model = None
     template = None
 
     def get(self, request, slug):
-        obj = get_object_or_404(self.model, slug__iexact=slug)
-        return render(request, self.template, context={
-                                                self.model.__name__.lower(): obj,
-                                                'admin_object': obj,
-                                                'detail': True
-                                                })
+        obj = get_object_or_404(self.model, slug=normalize_slug(slug))
+        depend_on(request, instance_dependency(obj))
+        context = {
+            self.model.__name__.lower(): obj,
+            'admin_object': obj,
+            'detail': True
+        }
+        context.update(self.get_extra_context(request, obj))
+        return render(request, self.template, context=context)
+
+    def get_extra_context(self, request, obj):
+        return {}
 
 
 class ObjectCreateMixin:
@@ -35,13 +80,13 @@ class ObjectCreateMixin:
         return render(request, self.template, context={'form': bound_form})
 
 
-class ObjectUpdateMixin:
+class ObjectUpdateMixin(SlugLookupMixin):
     model = None
     model_form = None
     template = None
 
     def get(self, request, slug):
-        obj = self.model.objects.get(slug__iexact=slug)
+        obj = self.model.objects.get(slug=normalize_slug(slug))
         bound_form = self.model_form(instance=obj)
         return render(request, self.template,
                       context={'form': bound_form,
@@ -49,7 +94,7 @@ class ObjectUpdateMixin:
                                })
 
     def post(self, request, slug):
-        obj = self.model.objects.get(slug__iexact=slug)
+        obj = self.model.objects.get(slug=normalize_slug(slug))
         bound_form = self.model_form(request.POST, instance=obj)
 
         if bound_form.is_valid():
@@ -60,17 +105,49 @@ class ObjectUpdateMixin:
                                self.model.__name__.lower(): obj
                                })
 
-class ObjectDeleteMixin:
+class ObjectDeleteMixin(SlugLookupMixin):
     model = None
     template = None
     redirect_url = None
 
     def get(self, request, slug):
-        obj = self.model.objects.get(slug__iexact=slug)
+        obj = self.model.objects.get(slug=normalize_slug(slug))
         return render(request, self.template, context={
                                                 self.model.__name__.lower(): obj
                                                 })
     def post(self, request, slug):
-        obj = self.model.objects.get(slug__iexact=slug)
+        obj = self.model.objects.get(slug=normalize_slug(slug))
         obj.delete()
         return redirect(reverse(self.redirect_url))
+
+
+def chunks(iterable, size):
+    """Lists of up to ``size`` items of ``iterable``, read lazily."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def add_worker_arguments(parser, batch_size, loop_help):
+    """``--batch-size``, ``--loop`` and ``--interval`` of a ``run_worker`` command."""
+    parser.add_argument('--batch-size', type=int, default=batch_size)
+    parser.add_argument('--loop', action='store_true', help=loop_help)
+    parser.add_argument('--interval', type=float, default=5,
+                        help='Seconds to sleep between polls with --loop')
+
+
+def run_worker(process_batch, options):
+    """
+    Call ``process_batch(batch_size)``, which returns how many items it
+    took, until a batch comes back short; with ``--loop`` keep polling every
+    ``--interval`` seconds instead of returning.
+    """
+    while True:
+        if process_batch(options['batch_size']) == options['batch_size']:
+            continue
+        if not options['loop']:
+            return
+        time.sleep(options['interval'])
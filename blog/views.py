@@ -1,3 +1,6 @@
+import math
+
+from django.conf import settings
 from django.shortcuts import render
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
@@ -6,10 +9,9 @@ from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.template.loader import render_to_string
 from django.views.generic import View
+from django.utils.decorators import method_decorator
 from django.urls import reverse
 from django.contrib.auth.mixins import PermissionRequiredMixin, UserPassesTestMixin
-from django.core.paginator import Paginator
-from django.db.models import Q
 from django.contrib.auth.models import User, Group
 from django.contrib.auth import login
 from django.http import Http404
@@ -18,38 +20,44 @@ from .models import Post, Tag, Profile
 from .utils import *
 from .forms import TagForm, PostForm, SignUpForm, UserForm, ProfileForm
 from .tokens import account_activation_token
-
+from .outbox import enqueue
+from .avatars import avatar_urls
+from .search import search_posts, SearchPaginator
+from .pagination import cursor_page_context, page_url
+from .pagecache import cache_anonymous_page, depend_on, post_dependency, POST_LIST, TAG_LIST
+from .conditional import (conditional, posts_list_validator, post_detail_validator,
+                          tag_detail_validator, tags_list_validator)
+
+@conditional(posts_list_validator)
+@cache_anonymous_page
 def posts_list(request):
     search_query = request.GET.get('search', '')
+    per_page = settings.BLOG_POSTS_PER_PAGE
+    depend_on(request, POST_LIST)
 
-    if search_query:
-        posts = Post.objects.filter(
-        Q(title__icontains=search_query)|
-        Q(body__icontains=search_query)
-        )
-        if not posts.count():
-            no_results = True
-            return render(request, 'blog/index.html', context={
-                                                        'no_results': no_results,
-                                                        'search_query': search_query
-                                                        })
-        else:
-            no_results = False
-    else:
-        posts = Post.objects.all()
+    if not search_query:
+        posts = Post.objects.defer('body').prefetch_related('tags')
+        context = cursor_page_context(request, posts, per_page)
+        return render(request, 'blog/index.html', context)
 
-    paginator = Paginator(posts, 3)
+    # Search results are ordered by relevance, so they keep numbered pages.
+    paginator = SearchPaginator(search_posts(search_query), per_page)
     page_number = request.GET.get('page', 1)
     page = paginator.get_page(page_number)
+    if not page.object_list:
+        return render(request, 'blog/index.html', context={
+                                                    'no_results': True,
+                                                    'search_query': search_query
+                                                    })
     is_paginated = page.has_other_pages()
 
     if page.has_previous():
-        prev_url = '?page={}'.format(page.previous_page_number())
+        prev_url = page_url(request, 'page', page.previous_page_number())
     else:
         prev_url = ''
 
     if page.has_next():
-        next_url = '?page={}'.format(page.next_page_number())
+        next_url = page_url(request, 'page', page.next_page_number())
     else:
         next_url = ''
 
@@ -80,7 +88,7 @@ def signup(request):
                         'uid': urlsafe_base64_encode(force_bytes(user.pk)),
                         'token': account_activation_token.make_token(user)
                         })
-            user.email_user(subject, message)
+            enqueue(subject, message, [user.email])
             return redirect('account_activation_sent')
     else:
         form = SignUpForm()
@@ -109,10 +117,17 @@ def activate(request, uidb64, token):
         return render(request, 'registration/account_activation_invalid.html')
 
 
+@method_decorator([conditional(post_detail_validator), cache_anonymous_page], name='get')
 class PostDetail(ObjectDetailMixin, View):
     model = Post
     template = 'blog/post_detail.html'
 
+    def get_extra_context(self, request, obj):
+        related_posts = list(Post.objects.filter(related_from__post=obj)
+                             .order_by('-related_from__score', '-pk').only('title', 'slug'))
+        depend_on(request, *[post_dependency(post.pk) for post in related_posts])
+        return {'related_posts': related_posts}
+
 
 class PostCreate(PermissionRequiredMixin, ObjectCreateMixin, View):
     model_form = PostForm
@@ -137,15 +152,41 @@ class PostDelete(PermissionRequiredMixin, ObjectDeleteMixin, View):
     raise_exception = True
 
 
+CLOUD_WEIGHTS = 5
+
+
+def set_cloud_weights(tags):
+    """Give each tag a ``weight`` from 1 to CLOUD_WEIGHTS, log-scaled on post_count."""
+    most = max([tag.post_count for tag in tags], default=0)
+    for tag in tags:
+        if most:
+            tag.weight = 1 + round((CLOUD_WEIGHTS - 1) * math.log1p(tag.post_count) / math.log1p(most))
+        else:
+            tag.weight = 1
+
+
+@conditional(tags_list_validator)
+@cache_anonymous_page
 def tags_list(request):
+    depend_on(request, TAG_LIST)
+    sort = request.GET.get('sort')
     tags = Tag.objects.all()
-    return render(request, 'blog/tags_list.html', context={'tags': tags})
+    if sort == 'popular':
+        tags = tags.order_by('-posts_30d', '-post_count', 'title')
+    tags = list(tags)
+    set_cloud_weights(tags)
+    return render(request, 'blog/tags_list.html', context={'tags': tags, 'sort': sort})
 
 
+@method_decorator([conditional(tag_detail_validator), cache_anonymous_page], name='get')
 class TagDetail(ObjectDetailMixin, View):
     model = Tag
     template = 'blog/tag_detail.html'
 
+    def get_extra_context(self, request, obj):
+        return cursor_page_context(request, obj.posts.defer('body').prefetch_related('tags'),
+                                   settings.BLOG_POSTS_PER_PAGE)
+
 
 class TagCreate(PermissionRequiredMixin, ObjectCreateMixin, View):
     model_form = TagForm
@@ -170,9 +211,28 @@ class TagDelete(PermissionRequiredMixin, ObjectDeleteMixin, View):
     raise_exception = True
 
 
+PROFILE_STATUSES = ('confirmed', 'unconfirmed')
+
+
 def profiles_list(request):
-    profiles = Profile.objects.all()
-    return render(request, 'blog/profiles_list.html', {'profiles': profiles})
+    profiles = (Profile.objects.select_related('user')
+                .only('email_confirmed', 'user__id', 'user__username'))
+    # Only staff get to see accounts that never confirmed their email.
+    status = request.GET.get('status', '') if request.user.is_staff else 'confirmed'
+    if status in PROFILE_STATUSES:
+        profiles = profiles.filter(email_confirmed=(status == 'confirmed'))
+    username_query = request.GET.get('username', '').strip()
+    if username_query:
+        profiles = profiles.filter(prefix_filter('user__username', username_query))
+
+    context = cursor_page_context(request, profiles, settings.BLOG_PROFILES_PER_PAGE,
+                                  ordering=('user__username',))
+    context.update({
+        'status': status,
+        'statuses': PROFILE_STATUSES,
+        'username_query': username_query,
+    })
+    return render(request, 'blog/profiles_list.html', context)
 
 
 class UserProfileDetail(View):
@@ -197,7 +257,7 @@ class UserProfileUpdate(View):
             obj2 = self.model2.objects.get(user=obj1)
             bound_form1 = self.model_form1(instance=obj1)
             bound_form2 = self.model_form2(instance=obj2)
-            show_avatar = obj2.avatar.url
+            show_avatar = avatar_urls(obj2, 400)['src']
             return render(request, self.template, context={
                     'form1' : bound_form1,
                     'form2' : bound_form2,
@@ -212,11 +272,12 @@ class UserProfileUpdate(View):
             obj2 = self.model2.objects.get(user=obj1)
             bound_form1 = self.model_form1(request.POST, instance=obj1)
             bound_form2 = self.model_form2(request.POST, request.FILES, instance=obj2)
-            show_avatar = obj2.avatar.url
+            show_avatar = avatar_urls(obj2, 400)['src']
             if 'delete_avatar' in request.POST:
                     obj2.avatar = Profile.avatar.field.default
+                    obj2.avatar_hash = ''
                     obj2.save()
-                    default_avatar = obj2.avatar.url
+                    default_avatar = avatar_urls(obj2, 400)['src']
                     return render(request, self.template, context={
                                             'form1' : bound_form1,
                                             'form2' : bound_form2,
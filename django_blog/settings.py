@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.perf.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +56,8 @@ ROOT_URLCONF = 'django_blog.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that also adds rendering time to blog.perf timings
+        'BACKEND': 'blog.perf.TimedDjangoTemplates',
         'DIRS': [
         os.path.join(BASE_DIR, 'templates')
         ],
@@ -85,6 +87,57 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# File based so every worker process on the box shares cached fragments,
+# pages and their invalidations.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+
+# Logging
+# https://docs.djangoproject.com/en/2.1/topics/logging/
+# blog.perf writes one JSON line per request, read by the perf_report command.
+# The file is only written when BLOG_PERF_LOG names one.
+
+BLOG_PERF_LOG = os.environ.get('BLOG_PERF_LOG')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {
+            'format': '%(message)s',
+        },
+    },
+    'handlers': {
+        'perf_file': {
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': BLOG_PERF_LOG,
+            'formatter': 'message',
+            'delay': True,
+        } if BLOG_PERF_LOG else {
+            'class': 'logging.NullHandler',
+        },
+    },
+    'loggers': {
+        'blog.perf': {
+            'handlers': ['perf_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -124,11 +177,62 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
         os.path.join(BASE_DIR, 'static')
 ]
+# Filled by collectstatic and served by django_blog.static_wsgi
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+if not DEBUG:
+    # Content-hashed names plus .gz/.br siblings, see django_blog.storage
+    STATICFILES_STORAGE = 'django_blog.storage.CompressedManifestStaticFilesStorage'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'static/media')
 
+# Square avatar thumbnails written by the process_avatars command
+BLOG_AVATAR_SIZES = (64, 160, 400)
+BLOG_AVATAR_MAX_PIXELS = 40 * 1000 * 1000
+
 
 LOGIN_REDIRECT_URL = 'redirect_blog_url'
 LOGOUT_REDIRECT_URL = 'redirect_blog_url'
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# Outbox retries: first retry after this many seconds, doubling each time
+BLOG_OUTBOX_RETRY_DELAY = 60
+BLOG_OUTBOX_MAX_ATTEMPTS = 5
+
+# Send per-request db/template/view timings in a Server-Timing header, they
+# tell every client about the internals, so only while debugging
+BLOG_SERVER_TIMING = DEBUG
+
+BLOG_POSTS_PER_PAGE = 3
+# Related posts kept per post, see blog.related
+BLOG_RELATED_POSTS = 5
+# Posts listed in the RSS and Atom feeds
+BLOG_FEED_ITEMS = 20
+# Primary keys per sitemap shard, the protocol allows up to 50000 urls
+BLOG_SITEMAP_SHARD_SIZE = 10000
+# JSON API page sizes (?limit=), larger pages are streamed in chunks
+BLOG_API_PAGE_SIZE = 20
+BLOG_API_MAX_PAGE_SIZE = 500
+BLOG_API_STREAM_THRESHOLD = 100
+BLOG_API_STREAM_CHUNK = 50
+BLOG_PROFILES_PER_PAGE = 50
+# Rendered post cards are cached for this many seconds
+BLOG_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Card cache hit/miss counts are added to the shared counters at most this often
+BLOG_CARD_STATS_FLUSH = 60
+# Upper bound on how long anonymous pages stay cached between invalidations
+BLOG_PAGE_CACHE_TIMEOUT = 60 * 60
+
+# 'auto' uses SQLite FTS5 when available, 'fts5' or 'memory' force a backend
+BLOG_SEARCH_BACKEND = 'auto'
+# How often the memory backend checks for posts indexed by other processes,
+# in seconds
+BLOG_SEARCH_RECHECK = 5
+# Search result counts are cached this many seconds and capped at the limit
+BLOG_SEARCH_COUNT_TTL = 300
+BLOG_SEARCH_COUNT_LIMIT = 1000
+# Title suggestions per request, and how often a process checks the cache
+# for changes made by other processes, in seconds
+BLOG_AUTOCOMPLETE_LIMIT = 10
+BLOG_AUTOCOMPLETE_RECHECK = 5
+# Reload the autocomplete index from the database this often, in seconds
+BLOG_AUTOCOMPLETE_REBUILD = 60 * 60
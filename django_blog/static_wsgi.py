@@ -0,0 +1,130 @@
+"""
+Serve collected static files and uploaded media straight from WSGI.
+
+``StaticFilesApplication`` wraps the Django application and answers
+requests under ``STATIC_URL`` and ``MEDIA_URL`` itself, so those never go
+through URL resolution or the middleware stack.  Files are handed to the
+server's ``wsgi.file_wrapper`` (``sendfile`` under gunicorn and uWSGI), the
+precompressed ``.br`` / ``.gz`` siblings written by
+``django_blog.storage`` are picked by ``Accept-Encoding``, and names that
+change whenever their content does are sent with far-future cache headers.
+"""
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from wsgiref.headers import Headers
+
+
+BLOCK_SIZE = 64 * 1024
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+# "styles.3b2a1c9d8e7f.css", as written by ManifestStaticFilesStorage.
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def hashed_name(path):
+    return bool(HASHED_NAME_RE.search(path))
+
+
+def content_addressed(path):
+    """Processed avatars live under ``avatars/<hash>/`` and never change."""
+    return path.startswith('avatars/')
+
+
+class Mount:
+    def __init__(self, prefix, root, immutable=hashed_name):
+        self.prefix = prefix
+        self.root = os.path.realpath(root) if root else None
+        self.immutable = immutable
+
+    def resolve(self, path):
+        """Absolute path of the file served for ``path``, or ``None``."""
+        full_path = os.path.realpath(os.path.join(self.root, path))
+        if not full_path.startswith(self.root + os.sep) or not os.path.isfile(full_path):
+            return None
+        return full_path
+
+
+class StaticFilesApplication:
+    def __init__(self, application, mounts):
+        self.application = application
+        self.mounts = [mount for mount in mounts if mount.prefix and mount.root]
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        for mount in self.mounts:
+            if path.startswith(mount.prefix):
+                return self.serve(mount, path[len(mount.prefix):], environ, start_response)
+        return self.application(environ, start_response)
+
+    def serve(self, mount, path, environ, start_response):
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD')])
+            return [b'']
+        full_path = mount.resolve(path)
+        if full_path is None:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found']
+
+        headers = Headers([])
+        content_type, _ = mimetypes.guess_type(full_path)
+        headers['Content-Type'] = content_type or 'application/octet-stream'
+        headers['Cache-Control'] = IMMUTABLE if mount.immutable(path) else REVALIDATE
+
+        encoded = [(encoding, full_path + suffix) for encoding, suffix in ENCODINGS
+                   if os.path.isfile(full_path + suffix)]
+        if encoded:
+            # Whichever variant this client gets, others get another one.
+            headers['Vary'] = 'Accept-Encoding'
+        full_path, encoding = self._negotiate(full_path, encoded, environ)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+
+        stat = os.stat(full_path)
+        etag = '"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size)
+        headers['ETag'] = etag
+        headers['Last-Modified'] = formatdate(stat.st_mtime, usegmt=True)
+
+        if self._not_modified(environ, etag, int(stat.st_mtime)):
+            start_response('304 Not Modified', headers.items())
+            return [b'']
+
+        headers['Content-Length'] = str(stat.st_size)
+        start_response('200 OK', headers.items())
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return [b'']
+        file = open(full_path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(file, BLOCK_SIZE)
+        return _read_chunks(file)
+
+    def _negotiate(self, full_path, encoded, environ):
+        """``(path, encoding)`` of the best of the ``encoded`` variants the client takes."""
+        accepted = environ.get('HTTP_ACCEPT_ENCODING', '')
+        accepted = {part.split(';')[0].strip() for part in accepted.split(',')}
+        for encoding, encoded_path in encoded:
+            if encoding in accepted:
+                return encoded_path, encoding
+        return full_path, None
+
+    def _not_modified(self, environ, etag, mtime):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            parsed = parsedate_tz(if_modified_since)
+            return parsed is not None and mktime_tz(parsed) >= mtime
+        return False
+
+
+def _read_chunks(file):
+    with file:
+        for chunk in iter(lambda: file.read(BLOCK_SIZE), b''):
+            yield chunk
@@ -0,0 +1,61 @@
+"""
+Static files storage for production.
+
+``collectstatic`` writes content-hashed copies of every file (through
+``ManifestStaticFilesStorage``) and, next to each hashed file worth
+compressing, a ``.gz`` and, when the optional ``brotli`` package is
+installed, a ``.br`` sibling for ``static_wsgi`` to serve directly.
+"""
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Formats that are already compressed gain nothing from another pass.
+SKIP_EXTENSIONS = {
+    '.gz', '.br', '.zip', '.png', '.jpg', '.jpeg', '.gif', '.webp',
+    '.ico', '.woff', '.woff2', '.mp4', '.webm',
+}
+MIN_SIZE = 256
+
+
+def compressors():
+    yield '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality=11)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_names):
+            for compressed_name in self._compress(hashed_name):
+                yield hashed_name, compressed_name, True
+
+    def _compress(self, name):
+        if os.path.splitext(name)[1].lower() in SKIP_EXTENSIONS:
+            return
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < MIN_SIZE:
+            return
+        for suffix, compress in compressors():
+            compressed = compress(data)
+            if len(compressed) >= len(data):
+                continue
+            with open(self.path(name) + suffix, 'wb') as target:
+                target.write(compressed)
+            yield name + suffix
@@ -1,10 +1,13 @@
 from django.contrib import admin
+from django.contrib.auth import views as auth_views
 from django.urls import path, include
 from django.contrib.staticfiles.urls import static
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 
 from . import settings
 from blog import views as blog_views
+from blog import sitemaps
+from blog.forms import OutboxPasswordResetForm
 from .views import redirect_blog
 
 
@@ -12,7 +15,12 @@ urlpatterns = [
 
     path('', redirect_blog, name='redirect_blog_url'),
     path('admin/', admin.site.urls),
+    path('sitemap.xml', sitemaps.index, name='sitemap_index_url'),
+    path('sitemap-<str:section>-<int:shard>.xml', sitemaps.shard, name='sitemap_shard_url'),
     path('blog/', include('blog.urls')),
+    path('accounts/password_reset/',
+         auth_views.PasswordResetView.as_view(form_class=OutboxPasswordResetForm),
+         name='password_reset'),
     path('accounts/', include('django.contrib.auth.urls')),
     path('accounts/signup/', blog_views.signup, name='signup'),
     path('account/account_activation_sent/', blog_views.account_activation_sent, name='account_activation_sent'),
@@ -21,5 +29,7 @@ urlpatterns = [
 
 ]
 
+# Development only, both are empty with DEBUG off, where django_blog.wsgi
+# serves these files itself.
 urlpatterns += staticfiles_urlpatterns()
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -2,6 +2,8 @@
 WSGI config for django_blog project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+Collected static files and uploaded media are answered by
+``StaticFilesApplication`` before Django sees the request.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
@@ -9,8 +11,14 @@ https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
+from .static_wsgi import Mount, StaticFilesApplication, content_addressed, hashed_name
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_blog.settings')
 
-application = get_wsgi_application()
+application = StaticFilesApplication(get_wsgi_application(), [
+    Mount(settings.STATIC_URL, settings.STATIC_ROOT, hashed_name),
+    Mount(settings.MEDIA_URL, settings.MEDIA_ROOT, content_addressed),
+])